@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Streaming archive builder for SoulStream
+Generates ZIP (store mode, ZIP64) and TAR archives on the fly.
+
+The archive layout is computed up front from the file names, sizes and
+modification times only, so the total length is known before any data is
+read and any byte range of the archive can be produced again later. This is
+what lets an interrupted download resume with a Range request.
+
+ZIP needs each file's CRC32 for its data descriptor and central directory
+entry. CRCs are computed while file bodies stream, kept in memory and also
+stored in hidden .<filename>.crc32 files next to the media. After a restart,
+a resumed range that starts in the central directory can then be answered
+without reading every file again.
+"""
+
+import os
+import struct
+import tarfile
+import threading
+import time
+import zlib
+import hashlib
+
+READ_SIZE = 1024 * 1024  # 1MB reads for file bodies
+CRC_CACHE_SIZE = 4096
+CRC_SIDECAR = struct.Struct('<4sQqI')  # magic, source size, source mtime_ns, crc32
+CRC_MAGIC = b'SSCR'
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x0808  # data descriptor follows, UTF-8 names
+ZIP_FILE_MODE = 0o100644 << 16
+
+TAR_BLOCK = 512
+
+_crc_cache = {}
+_crc_lock = threading.Lock()
+
+
+class ArchiveEntry:
+    """A single file to be stored in the archive"""
+
+    def __init__(self, name, path):
+        stat = os.stat(path)
+        self.name = name
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.key = (path, stat.st_size, stat.st_mtime_ns)
+
+
+def crc_path_for(path):
+    """Hidden CRC file stored next to the media file"""
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.crc32")
+
+
+def _load_crc(entry):
+    """Return the CRC stored next to the file, or None if missing or stale"""
+    try:
+        with open(crc_path_for(entry.path), 'rb') as f:
+            magic, size, mtime_ns, crc = CRC_SIDECAR.unpack(f.read(CRC_SIDECAR.size))
+    except (OSError, struct.error):
+        return None
+    if magic != CRC_MAGIC or (entry.path, size, mtime_ns) != entry.key:
+        return None  # Media changed since the CRC was stored
+    return crc
+
+
+def _save_crc(entry, crc):
+    """Store a CRC next to the file; failures only cost a re-read later"""
+    crc_path = crc_path_for(entry.path)
+    temp_path = f"{crc_path}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(CRC_SIDECAR.pack(CRC_MAGIC, entry.size, entry.key[2], crc))
+        os.replace(temp_path, crc_path)
+    except OSError:
+        pass
+
+
+def _cached_crc(entry):
+    """Return the CRC32 of an entry, reading the file if it is not cached"""
+    with _crc_lock:
+        crc = _crc_cache.get(entry.key)
+    if crc is not None:
+        return crc
+
+    crc = _load_crc(entry)
+    if crc is not None:
+        _remember_crc(entry, crc)
+        return crc
+
+    crc = 0
+    with open(entry.path, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    _store_crc(entry, crc)
+    return crc
+
+
+def _store_crc(entry, crc):
+    """Remember a CRC computed while streaming so resumed ranges can reuse it"""
+    _remember_crc(entry, crc)
+    _save_crc(entry, crc)
+
+
+def _remember_crc(entry, crc):
+    """Keep a CRC in the in-memory cache"""
+    with _crc_lock:
+        if len(_crc_cache) >= CRC_CACHE_SIZE:
+            _crc_cache.pop(next(iter(_crc_cache)))
+        _crc_cache[entry.key] = crc
+
+
+def _dos_datetime(mtime):
+    """Convert an epoch timestamp to the (time, date) pair used by ZIP"""
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class StreamingArchive:
+    """
+    A fixed sequence of segments making up an archive.
+
+    Each segment is one of:
+      ('bytes', data)      - header bytes known in advance
+      ('file', entry)      - the body of a file, read from disk
+      ('lazy', callable)   - bytes that depend on file CRCs
+    """
+
+    mimetype = 'application/octet-stream'
+    extension = ''
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.segments = []
+        self.length = 0
+        self._build()
+
+    def _add(self, kind, payload, length):
+        self.segments.append((self.length, length, kind, payload))
+        self.length += length
+
+    def _add_bytes(self, data):
+        self._add('bytes', data, len(data))
+
+    def _build(self):
+        raise NotImplementedError
+
+    @property
+    def etag(self):
+        """Stable identifier of the layout, used for If-Range checks"""
+        digest = hashlib.sha1(self.extension.encode())
+        for entry in self.entries:
+            digest.update(f"{entry.name}\0{entry.size}\0{entry.key[2]}\0".encode('utf-8'))
+        return digest.hexdigest()[:32]
+
+    def iter_range(self, start=0, stop=None):
+        """Yield the archive bytes in [start, stop)"""
+        if stop is None:
+            stop = self.length
+
+        for offset, length, kind, payload in self.segments:
+            end = offset + length
+            if end <= start or length == 0:
+                continue
+            if offset >= stop:
+                break
+
+            lo = max(start, offset) - offset
+            hi = min(stop, end) - offset
+
+            if kind == 'bytes':
+                yield payload[lo:hi]
+            elif kind == 'lazy':
+                yield payload()[lo:hi]
+            else:
+                yield from self._iter_file(payload, lo, hi)
+
+    def _iter_file(self, entry, lo, hi):
+        """Yield part of a file body, caching its CRC when read in full"""
+        whole = lo == 0 and hi == entry.size
+        crc = 0
+        remaining = hi - lo
+        with open(entry.path, 'rb') as f:
+            f.seek(lo)
+            while remaining > 0:
+                data = f.read(min(READ_SIZE, remaining))
+                if not data:
+                    raise IOError(f"{entry.name} changed while streaming")
+                if whole:
+                    crc = zlib.crc32(data, crc)
+                remaining -= len(data)
+                yield data
+        if whole:
+            _store_crc(entry, crc)
+
+
+class ZipArchive(StreamingArchive):
+    """ZIP archive with stored (uncompressed) entries and ZIP64 support"""
+
+    mimetype = 'application/zip'
+    extension = 'zip'
+
+    def _build(self):
+        central = []
+
+        for entry in self.entries:
+            header_offset = self.length
+            name = entry.name.encode('utf-8')
+            dos_time, dos_date = _dos_datetime(entry.mtime)
+            zip64 = entry.size >= ZIP64_LIMIT
+
+            if zip64:
+                extra = struct.pack('<HHQQ', 1, 16, entry.size, entry.size)
+                size_field = ZIP64_LIMIT
+            else:
+                extra = b''
+                size_field = entry.size
+
+            self._add_bytes(struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, ZIP_FLAGS, 0,
+                dos_time, dos_date, 0, size_field, size_field, len(name), len(extra)
+            ) + name + extra)
+            self._add('file', entry, entry.size)
+            self._add('lazy', self._descriptor(entry, zip64), 24 if zip64 else 16)
+
+            central.append((entry, name, dos_time, dos_date, header_offset))
+
+        cd_offset = self.length
+        cd_length = sum(46 + len(name) + len(self._central_extra(entry, offset))
+                        for entry, name, _, _, offset in central)
+        self._add('lazy', lambda: self._central_directory(central), cd_length)
+        self._add_bytes(self._end_records(len(central), cd_offset, cd_length))
+
+    @staticmethod
+    def _descriptor(entry, zip64):
+        def build():
+            crc = _cached_crc(entry)
+            if zip64:
+                return struct.pack('<IIQQ', 0x08074b50, crc, entry.size, entry.size)
+            return struct.pack('<IIII', 0x08074b50, crc, entry.size, entry.size)
+        return build
+
+    @staticmethod
+    def _central_extra(entry, offset):
+        fields = []
+        if entry.size >= ZIP64_LIMIT:
+            fields += [entry.size, entry.size]
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+        if not fields:
+            return b''
+        return struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields)
+
+    def _central_directory(self, central):
+        records = []
+        for entry, name, dos_time, dos_date, offset in central:
+            extra = self._central_extra(entry, offset)
+            version = 45 if extra else 20
+            size_field = ZIP64_LIMIT if entry.size >= ZIP64_LIMIT else entry.size
+            records.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version,
+                ZIP_FLAGS, 0, dos_time, dos_date, _cached_crc(entry),
+                size_field, size_field, len(name), len(extra), 0, 0, 0,
+                ZIP_FILE_MODE, min(offset, ZIP64_LIMIT)
+            ) + name + extra)
+        return b''.join(records)
+
+    @staticmethod
+    def _end_records(count, cd_offset, cd_length):
+        records = b''
+        if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_length >= ZIP64_LIMIT:
+            zip64_offset = cd_offset + cd_length
+            records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                                   count, count, cd_length, cd_offset)
+            records += struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1)
+        records += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0,
+                               min(count, 0xFFFF), min(count, 0xFFFF),
+                               min(cd_length, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0)
+        return records
+
+
+class TarArchive(StreamingArchive):
+    """POSIX (pax) TAR archive; pax headers carry sizes over 8GB"""
+
+    mimetype = 'application/x-tar'
+    extension = 'tar'
+
+    def _build(self):
+        for entry in self.entries:
+            info = tarfile.TarInfo(entry.name)
+            info.size = entry.size
+            info.mtime = entry.mtime
+            info.mode = 0o644
+            self._add_bytes(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+            self._add('file', entry, entry.size)
+            padding = -entry.size % TAR_BLOCK
+            if padding:
+                self._add_bytes(b'\0' * padding)
+        self._add_bytes(b'\0' * (TAR_BLOCK * 2))
+
+
+ARCHIVE_FORMATS = {
+    'zip': ZipArchive,
+    'tar': TarArchive,
+}
+
+
+def build_archive(fmt, entries):
+    """Create an archive of the given format over a list of ArchiveEntry"""
+    archive_class = ARCHIVE_FORMATS.get(fmt)
+    if archive_class is None:
+        raise ValueError(f"Unsupported archive format: {fmt}")
+    return archive_class(sorted(entries, key=lambda e: e.name))
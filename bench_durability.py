@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark for SoulStream durability modes
+Simulates concurrent chunked uploads and reports throughput for each mode.
+
+Run it on the target disk (SD card, USB drive, ...) since sync cost depends
+almost entirely on the storage device:
+
+    python3 bench_durability.py --dir /media/soulstream/bench --uploads 4 --size-mb 64
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+from durability import MODES, DurabilityPolicy
+
+
+def simulate_upload(policy, directory, name, size, chunk_size):
+    """Write one upload as chunks, then combine and complete it"""
+    data = os.urandom(chunk_size)
+    final_path = os.path.join(directory, name)
+    chunk_files = []
+    for i in range(max(1, size // chunk_size)):
+        chunk_path = f"{final_path}.chunk_{i}"
+        with open(chunk_path, 'wb') as f:
+            f.write(data)
+        policy.chunk_written(chunk_path)
+        chunk_files.append(chunk_path)
+
+    temp_path = f"{final_path}.part"
+    with open(temp_path, 'wb') as outfile:
+        for chunk_path in chunk_files:
+            with open(chunk_path, 'rb') as infile:
+                shutil.copyfileobj(infile, outfile)
+    policy.complete(temp_path, final_path)
+    for chunk_path in chunk_files:
+        os.remove(chunk_path)
+
+
+def bench_mode(mode, directory, uploads, size, chunk_size, interval):
+    """Return MB/s for concurrent uploads in one durability mode"""
+    policy = DurabilityPolicy(mode, interval)
+    threads = [
+        threading.Thread(target=simulate_upload,
+                         args=(policy, directory, f"upload{i}.mp4", size, chunk_size))
+        for i in range(uploads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return uploads * size / (1024 * 1024) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SoulStream durability modes')
+    parser.add_argument('--dir', default=None, help='Directory to benchmark in (default: temp dir)')
+    parser.add_argument('--uploads', type=int, default=4, help='Concurrent uploads')
+    parser.add_argument('--size-mb', type=int, default=64, help='Size of each upload in MB')
+    parser.add_argument('--chunk-kb', type=int, default=1024, help='Chunk size in KB')
+    parser.add_argument('--interval', type=float, default=0.05, help='Group commit interval in seconds')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), help='Modes to test')
+
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+    chunk_size = args.chunk_kb * 1024
+
+    print(f"{args.uploads} concurrent uploads of {args.size_mb}MB in {args.chunk_kb}KB chunks")
+    print(f"{'mode':<14} {'MB/s':>8}")
+    for mode in args.modes:
+        directory = tempfile.mkdtemp(prefix='soulstream-bench-', dir=args.dir)
+        try:
+            throughput = bench_mode(mode, directory, args.uploads, size, chunk_size, args.interval)
+            print(f"{mode:<14} {throughput:>8.1f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
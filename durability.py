@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Durability policies for SoulStream uploads
+Controls when upload data is forced to disk before a request is acknowledged.
+
+none:          nothing is synced. An acknowledged upload may be lost or
+               truncated if power is cut before the kernel writes it back.
+on-complete:   chunks are not synced; the finished file is synced and
+               renamed into place before the final acknowledgement, so a
+               completed upload survives a power cut. Acknowledged chunks
+               of an unfinished upload may be lost and must be re-sent.
+group-commit:  every chunk and the finished file are synced before they
+               are acknowledged. Syncs from concurrent uploads are batched
+               by a background thread so they share flushes.
+
+In every mode the finished file is written under a temporary name and
+renamed into place, so readers never see a partially combined file.
+"""
+
+import os
+import time
+import threading
+
+MODES = ('none', 'on-complete', 'group-commit')
+DEFAULT_GROUP_INTERVAL = 0.05  # seconds to gather syncs into one batch
+
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+
+def sync_file(path):
+    """Flush a file's data to disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        _fdatasync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_directory(path):
+    """Flush a directory entry (e.g. after a rename) to disk"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return  # Not supported on Windows
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GroupCommitter:
+    """Background thread that syncs files in batches"""
+
+    def __init__(self, interval=DEFAULT_GROUP_INTERVAL):
+        self.interval = interval
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+    def sync(self, path):
+        """Block until path has been synced as part of a batch"""
+        request = {'path': path, 'done': threading.Event(), 'error': None}
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify()
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let concurrent uploads join this batch
+            time.sleep(self.interval)
+            with self._cond:
+                batch, self._pending = self._pending, []
+
+            # Newly created files also need their directory entries flushed;
+            # each directory is synced once per batch
+            directories = {}
+            for request in batch:
+                try:
+                    sync_file(request['path'])
+                    directory = os.path.dirname(os.path.abspath(request['path']))
+                    directories.setdefault(directory, []).append(request)
+                except OSError as e:
+                    request['error'] = e
+            for directory, requests in directories.items():
+                try:
+                    sync_directory(directory)
+                except OSError as e:
+                    for request in requests:
+                        request['error'] = e
+
+            for request in batch:
+                request['done'].set()
+
+
+class DurabilityPolicy:
+    """Applies one durability mode to chunk writes and upload completion"""
+
+    def __init__(self, mode, group_interval=DEFAULT_GROUP_INTERVAL):
+        if mode not in MODES:
+            raise ValueError(f"Unknown durability mode: {mode}")
+        self.mode = mode
+        self._committer = GroupCommitter(group_interval) if mode == 'group-commit' else None
+
+    def chunk_written(self, path):
+        """Called after a chunk is saved; returns True if the chunk is durable"""
+        if self._committer is None:
+            return False
+        self._committer.sync(path)
+        return True
+
+    def complete(self, temp_path, final_path):
+        """
+        Move a finished upload into place; returns True if it is durable.
+
+        The sequence is fsync(file), rename, fsync(directory), so after a
+        crash either the old name is absent or the complete file is present.
+        """
+        durable = self.mode != 'none'
+        if self._committer is not None:
+            self._committer.sync(temp_path)
+        elif durable:
+            sync_file(temp_path)
+        os.replace(temp_path, final_path)
+        if durable:
+            sync_directory(os.path.dirname(os.path.abspath(final_path)))
+        return durable
@@ -73,6 +73,13 @@ chown $SERVICE_USER:$SERVICE_USER $APP_DIR
 # Copy application files
 print_status "Copying application files..."
 cp server.py $APP_DIR/
+cp archive.py $APP_DIR/
+cp seek_index.py $APP_DIR/
+cp replication.py $APP_DIR/
+cp profiler.py $APP_DIR/
+cp listing.py $APP_DIR/
+cp workers.py $APP_DIR/
+cp durability.py $APP_DIR/
 cp requirements.txt $APP_DIR/
 cp index.html $APP_DIR/
 cp styles.css $APP_DIR/
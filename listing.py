@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Streaming file listings for SoulStream
+Both servers answer GET /files in the format chosen by the Accept header:
+plain JSON (the default), NDJSON, or a compact binary stream. The streaming
+formats send the first row straight away and then batches of rows, so memory
+stays flat and clients see data before the folder scan ends.
+
+Binary format (little-endian): the magic bytes, then one record per file of
+<uint16 name length><uint64 size><int64 mtime> followed by the UTF-8 name,
+until the end of the stream.
+"""
+
+import json
+import struct
+
+from flask import Response, request
+
+JSON_MIMETYPE = 'application/json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+LISTING_BINARY_MIMETYPE = 'application/vnd.soulstream.filelist'
+LISTING_MAGIC = b'SSFL\x01'
+LISTING_ROW = struct.Struct('<HQq')  # name length, size in bytes, mtime (epoch seconds)
+LISTING_FLUSH_ROWS = 256
+
+
+def negotiate():
+    """Return the listing format the client asked for; plain JSON by default"""
+    return request.accept_mimetypes.best_match(
+        [JSON_MIMETYPE, NDJSON_MIMETYPE, LISTING_BINARY_MIMETYPE], JSON_MIMETYPE)
+
+
+def batch_rows(rows):
+    """Join encoded listing rows into chunks: the first row on its own, then batches"""
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    # Send the first row straight away so clients see data before the scan ends
+    yield first
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= LISTING_FLUSH_ROWS:
+            yield b''.join(batch)
+            batch = []
+    if batch:
+        yield b''.join(batch)
+
+
+def stream_ndjson(rows):
+    """One JSON object per line, from an iterable of dicts"""
+    return batch_rows((json.dumps(row) + '\n').encode('utf-8') for row in rows)
+
+
+def encode_binary_row(name, size, mtime):
+    """Pack one binary listing record"""
+    encoded = name.encode('utf-8')
+    return LISTING_ROW.pack(len(encoded), size, int(mtime)) + encoded
+
+
+def stream_binary(files):
+    """Binary listing from an iterable of (name, size, mtime)"""
+    yield LISTING_MAGIC
+    yield from batch_rows(encode_binary_row(*file) for file in files)
+
+
+def streaming_response(output, body):
+    """Streamed listing response; the format depends on Accept, so caches must vary on it"""
+    response = Response(body, mimetype=output)
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Profiling tools for SoulStream
+A sampling profiler that can be switched on for a few seconds while the
+server runs, and per-phase request timings kept in a ring buffer of recent
+slow requests.
+
+The profiler reads sys._current_frames() from a background thread, so
+request threads pay nothing while it is off and very little while it is on.
+Output is in the collapsed-stack format used by flamegraph.pl and
+speedscope, or rendered directly as a flamegraph SVG.
+
+Request timings are used by both the media server and the upload server.
+"""
+
+import os
+import sys
+import time
+import threading
+import zlib
+from collections import Counter, deque
+from html import escape
+
+from flask import g
+from werkzeug.wsgi import ClosingIterator
+
+DEFAULT_INTERVAL = 0.005  # seconds between samples
+MIN_INTERVAL = 0.001  # shorter intervals would keep a core busy walking stacks
+MAX_PROFILE_SECONDS = 300
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads for a fixed time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.seconds = 0
+        self.interval = DEFAULT_INTERVAL
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, interval=DEFAULT_INTERVAL):
+        """Start sampling; returns False if a profile is already running"""
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started = time.time()
+            self.seconds = min(seconds, MAX_PROFILE_SECONDS)
+            self.interval = max(interval, MIN_INTERVAL)
+            self._thread = threading.Thread(target=self._run, args=(self.seconds, self.interval),
+                                            name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, seconds, interval):
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = Counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                sampled[';'.join(reversed(stack))] += 1
+            with self._lock:
+                self.stacks.update(sampled)
+                self.samples += 1
+            time.sleep(interval)
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'started': self.started,
+                'seconds': self.seconds,
+                'interval': self.interval,
+                'samples': self.samples,
+                'stacks': len(self.stacks)
+            }
+
+    def collapsed(self):
+        """Return samples as 'frame;frame;frame count' lines"""
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def flamegraph(self, title='SoulStream profile'):
+        """Render the samples as a flamegraph SVG"""
+        with self._lock:
+            stacks = dict(self.stacks)
+        return render_flamegraph(stacks, title)
+
+
+def render_flamegraph(stacks, title, width=1200, row_height=16):
+    """Render collapsed stacks ({'a;b;c': count}) as an SVG flamegraph"""
+    root = {'count': 0, 'children': {}}
+    for stack, count in stacks.items():
+        node = root
+        node['count'] += count
+        for frame in stack.split(';'):
+            node = node['children'].setdefault(frame, {'count': 0, 'children': {}})
+            node['count'] += count
+
+    rects = []
+    max_depth = 0
+    total = root['count'] or 1
+    # Depth-first layout: children are placed left to right inside their parent
+    pending = [(root['children'], 0.0, 0)]
+    while pending:
+        children, x, depth = pending.pop()
+        max_depth = max(max_depth, depth + 1)
+        for frame, node in sorted(children.items()):
+            w = node['count'] / total * width
+            if w >= 0.5:
+                rects.append((frame, node['count'], x, depth, w))
+                pending.append((node['children'], x, depth + 1))
+            x += w
+
+    height = (max_depth + 2) * row_height
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="{row_height - 4}">{escape(title)} ({total} samples)</text>'
+    ]
+    for frame, count, x, depth, w in rects:
+        y = height - (depth + 1) * row_height
+        hue = 20 + zlib.crc32(frame.encode()) % 40
+        label = escape(frame)
+        chars = int(w / 7)
+        text = label if len(frame) <= chars else escape(frame[:max(chars - 2, 0)]) + '..'
+        parts.append(
+            f'<g><title>{label} ({count} samples, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" '
+            f'fill="hsl({hue},90%,60%)"/>'
+            + (f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{text}</text>' if chars > 2 else '')
+            + '</g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+def close_after_body(response, callback):
+    """Run callback once the response body has been sent, including file responses"""
+    if not response.direct_passthrough:
+        response.call_on_close(callback)
+        return
+
+    # Werkzeug skips close callbacks for passthrough bodies (e.g. send_file).
+    # Hook the body's own close() rather than wrapping it, so servers can still
+    # recognise their wsgi.file_wrapper and use sendfile.
+    body = response.response
+    original_close = getattr(body, 'close', None)
+
+    def close():
+        try:
+            if original_close is not None:
+                original_close()
+        finally:
+            callback()
+
+    try:
+        body.close = close
+    except AttributeError:
+        # Generators and other bodies that do not take attributes
+        response.response = ClosingIterator(body, callback)
+
+
+class RequestTimer:
+    """Times the phases of one request"""
+
+    def __init__(self, timings, route):
+        self._timings = timings
+        self.route = route
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.phases = {}
+        self.detail = None
+        self._respond_start = None
+
+    def phase(self, name):
+        """Context manager that adds the time spent inside it to a phase"""
+        return _Phase(self, name)
+
+    def responding(self):
+        """Mark the point where the view returned and the response starts sending"""
+        self._respond_start = time.perf_counter()
+
+    def finish(self, status=200):
+        """Record the request; call once when the response is done"""
+        now = time.perf_counter()
+        if self._respond_start is not None:
+            self.phases['respond'] = now - self._respond_start
+        self._timings.record(self, now - self._start, status)
+
+
+class _Phase:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.timer.phases[self.name] = self.timer.phases.get(self.name, 0.0) + elapsed
+        return False
+
+
+class RequestTimings:
+    """Per-route and per-phase totals plus a ring buffer of slow requests"""
+
+    def __init__(self, slow_seconds=1.0, capacity=100):
+        self.slow_seconds = slow_seconds
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._slow = deque(maxlen=capacity)
+
+    def start(self, route):
+        return RequestTimer(self, route)
+
+    def start_request(self, route):
+        """Start timing the current Flask request; install() finishes it"""
+        g.timer = self.start(route)
+        return g.timer
+
+    def install(self, app):
+        """Finish each timed request once its response body has been sent"""
+        @app.after_request
+        def record_timing(response):
+            timer = g.pop('timer', None)
+            if timer is not None:
+                timer.responding()
+                close_after_body(response, lambda: timer.finish(response.status_code))
+            return response
+
+    def record(self, timer, total, status):
+        with self._lock:
+            stats = self._routes.setdefault(timer.route, {
+                'count': 0, 'total': 0.0, 'max': 0.0, 'phases': {}
+            })
+            stats['count'] += 1
+            stats['total'] += total
+            stats['max'] = max(stats['max'], total)
+            for name, elapsed in timer.phases.items():
+                stats['phases'][name] = stats['phases'].get(name, 0.0) + elapsed
+
+            if total >= self.slow_seconds:
+                self._slow.append({
+                    'route': timer.route,
+                    'detail': timer.detail,
+                    'started': timer.started,
+                    'status': status,
+                    'total': round(total, 6),
+                    'phases': {name: round(elapsed, 6) for name, elapsed in timer.phases.items()}
+                })
+
+    def snapshot(self):
+        """Route statistics (averages in seconds) and recent slow requests, newest first"""
+        with self._lock:
+            routes = {}
+            for route, stats in self._routes.items():
+                routes[route] = {
+                    'count': stats['count'],
+                    'avg': round(stats['total'] / stats['count'], 6),
+                    'max': round(stats['max'], 6),
+                    'phases_avg': {name: round(elapsed / stats['count'], 6)
+                                   for name, elapsed in stats['phases'].items()}
+                }
+            return {
+                'slow_threshold': self.slow_seconds,
+                'routes': routes,
+                'slow_requests': list(reversed(self._slow))
+            }
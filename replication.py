@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Peer replication for SoulStream
+Copies completed uploads to other SoulStream instances and spreads reads
+across the replicas that hold a file.
+
+Each node polls its peers for their load (active streams) and, less often,
+their catalog (file name -> size). Files that exist locally but are missing
+on a peer, or smaller there, are pushed to it, so a peer that was offline
+catches up and a truncated copy is repaired from the catalog diff. Pushed files are written under a temporary name and renamed
+when complete, so a peer never lists a partial copy.
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+LOAD_POLL_INTERVAL = 2.0  # seconds
+CATALOG_POLL_INTERVAL = 30.0  # seconds
+SETTLE_SECONDS = 30  # files modified more recently may still be uploading
+REQUEST_TIMEOUT = 10
+
+# Set on requests between peers so they are always served locally
+LOCAL_PARAM = 'local'
+
+
+class Peer:
+    """Another SoulStream instance and what we last heard from it"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.catalog = {}
+        self.active = 0
+        self.healthy = False
+
+    def file_url(self, filename):
+        return f"{self.url}/files/{urllib.parse.quote(filename)}?{LOCAL_PARAM}=1"
+
+    def addresses(self):
+        """Resolve the peer's host to the IP addresses it may connect from"""
+        host = urllib.parse.urlsplit(self.url).hostname
+        try:
+            return {info[4][0] for info in socket.getaddrinfo(host, None)}
+        except (OSError, UnicodeError):
+            return set()
+
+    def __repr__(self):
+        return f"<Peer {self.url}>"
+
+
+class Replicator:
+    """Pushes files to peers and picks the least-loaded replica for reads"""
+
+    def __init__(self, upload_folder, peer_urls, is_media_file):
+        self.upload_folder = upload_folder
+        self.peers = [Peer(url) for url in peer_urls]
+        self.is_media_file = is_media_file
+        self._active = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = set()
+
+    # Local state
+
+    @property
+    def active(self):
+        """Number of streams this node is currently serving"""
+        with self._lock:
+            return self._active
+
+    def stream_started(self):
+        with self._lock:
+            self._active += 1
+
+    def stream_finished(self):
+        with self._lock:
+            self._active -= 1
+
+    def local_catalog(self, settled_only=False):
+        """Return {filename: size} for local media files"""
+        catalog = {}
+        now = time.time()
+        if not os.path.exists(self.upload_folder):
+            return catalog
+        for entry in os.scandir(self.upload_folder):
+            if not entry.is_file() or not self.is_media_file(entry.name):
+                continue
+            stat = entry.stat()
+            if settled_only and now - stat.st_mtime < SETTLE_SECONDS:
+                continue
+            catalog[entry.name] = stat.st_size
+        return catalog
+
+    def status(self):
+        """Load and peer health, as reported to peers and admins"""
+        return {
+            'active': self.active,
+            'peers': [{'url': peer.url, 'healthy': peer.healthy, 'active': peer.active,
+                       'files': len(peer.catalog)} for peer in self.peers]
+        }
+
+    # Reads
+
+    def choose_replica(self, filename):
+        """Return a less-loaded peer holding filename, or None to serve locally"""
+        path = os.path.join(self.upload_folder, filename)
+        local_size = os.path.getsize(path) if os.path.isfile(path) else None
+
+        candidates = [peer for peer in self.peers if peer.healthy
+                      and filename in peer.catalog
+                      and (local_size is None or peer.catalog[filename] == local_size)]
+        if not candidates:
+            return None
+
+        best = min(candidates, key=lambda peer: peer.active)
+        if local_size is not None and best.active >= self.active:
+            return None
+        with self._lock:
+            # Count the stream against the peer until the next load poll
+            best.active += 1
+        return best
+
+    def peer_unreachable(self, peer, error):
+        """Take a peer out of rotation after a failed read until the next poll succeeds"""
+        with self._lock:
+            # Undo the stream counted by choose_replica()
+            peer.active = max(peer.active - 1, 0)
+            if peer.healthy:
+                logger.warning(f"Peer {peer.url} unreachable: {error}")
+            peer.healthy = False
+
+    def open_from_peer(self, peer, filename, range_header=None):
+        """Open a streaming response for a file from a peer (for proxying)"""
+        request = urllib.request.Request(peer.file_url(filename))
+        if range_header:
+            request.add_header('Range', range_header)
+        return urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT)
+
+    # Writes
+
+    def file_added(self, filename):
+        """Queue a newly completed upload for every peer"""
+        for peer in self.peers:
+            self._enqueue(peer, filename)
+
+    def is_peer_address(self, address):
+        """Check whether a remote address belongs to one of the configured peers"""
+        return any(address in peer.addresses() for peer in self.peers)
+
+    def receive(self, filename, stream, length):
+        """Store a file pushed by a peer; returns False if it was incomplete"""
+        final_path = os.path.join(self.upload_folder, filename)
+        temp_path = os.path.join(self.upload_folder, f".{filename}.repl")
+        received = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    data = stream.read(READ_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                    received += len(data)
+            if received != length:
+                return False
+            os.replace(temp_path, final_path)
+            return True
+        finally:
+            # Nothing is left behind by short or failed transfers
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def _outdated(local, remote):
+        """Files the peer lacks or holds a smaller (e.g. truncated) copy of"""
+        # Only the larger copy is pushed, so two nodes never swap copies forever
+        return [filename for filename, size in local.items()
+                if remote.get(filename, -1) < size]
+
+    def _enqueue(self, peer, filename):
+        key = (peer.url, filename)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put((peer, filename))
+
+    def _push(self, peer, filename):
+        path = os.path.join(self.upload_folder, filename)
+        size = os.path.getsize(path)
+        url = f"{peer.url}/replication/files/{urllib.parse.quote(filename)}"
+        with open(path, 'rb') as f:
+            request = urllib.request.Request(url, data=f, method='PUT', headers={
+                'Content-Length': str(size),
+                'Content-Type': 'application/octet-stream'
+            })
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                response.read()
+        peer.catalog[filename] = size
+        logger.info(f"Replicated {filename} to {peer.url}")
+
+    # Background threads
+
+    def start(self):
+        """Start the push worker and the peer poller"""
+        if not self.peers:
+            return
+        threading.Thread(target=self._push_worker, name='replication-push', daemon=True).start()
+        threading.Thread(target=self._poll_worker, name='replication-poll', daemon=True).start()
+        logger.info(f"Replicating to peers: {', '.join(peer.url for peer in self.peers)}")
+
+    def _push_worker(self):
+        while True:
+            peer, filename = self._queue.get()
+            try:
+                self._push(peer, filename)
+            except (OSError, urllib.error.URLError) as e:
+                # The next catalog diff will queue it again
+                logger.warning(f"Replication of {filename} to {peer.url} failed: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard((peer.url, filename))
+
+    def _fetch_json(self, peer, path):
+        with urllib.request.urlopen(f"{peer.url}{path}", timeout=REQUEST_TIMEOUT) as response:
+            return json.loads(response.read())
+
+    def _poll_worker(self):
+        last_catalog_poll = 0.0
+        while True:
+            sync_catalogs = time.monotonic() - last_catalog_poll >= CATALOG_POLL_INTERVAL
+            if sync_catalogs:
+                last_catalog_poll = time.monotonic()
+            local = None
+
+            for peer in self.peers:
+                try:
+                    # Peers coming back online get a catalog diff straight away
+                    if sync_catalogs or not peer.healthy:
+                        data = self._fetch_json(peer, '/replication/catalog')
+                        peer.catalog = data['files']
+                        if local is None:
+                            local = self.local_catalog(settled_only=True)
+                        for filename in sorted(self._outdated(local, peer.catalog)):
+                            self._enqueue(peer, filename)
+                    else:
+                        data = self._fetch_json(peer, '/replication/status')
+                    peer.active = data['active']
+                    if not peer.healthy:
+                        logger.info(f"Peer {peer.url} is online")
+                    peer.healthy = True
+                except (OSError, ValueError, KeyError, urllib.error.URLError) as e:
+                    if peer.healthy:
+                        logger.warning(f"Peer {peer.url} unreachable: {e}")
+                    peer.healthy = False
+
+            time.sleep(LOAD_POLL_INTERVAL)
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+Seek index for SoulStream
+Extracts keyframe time -> byte offset tables from MP4/MOV (stss, stts,
+ctts, elst, stsc, stsz, stco/co64) and Matroska/WebM (Cues), and stores
+them as compact binary files next to the media so players can fetch the
+exact byte range for a seek instead of probing. MP4 times are presentation
+times, so they match the player's clock for files with B-frames.
+
+Index file layout (little-endian):
+    header   magic 'SSKI', version, source size, source mtime_ns, count
+    times    count x float64 seconds
+    offsets  count x uint64 byte offsets
+"""
+
+import os
+import sys
+import struct
+import bisect
+import logging
+from array import array
+from functools import lru_cache
+
+from workers import FileWorker
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'SSKI'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<4sHxxQqI')
+
+MP4_EXTENSIONS = {'mp4', 'm4v', 'mov'}
+MKV_EXTENSIONS = {'mkv', 'webm'}
+SUPPORTED_EXTENSIONS = MP4_EXTENSIONS | MKV_EXTENSIONS
+
+MP4_CONTAINERS = {b'moov', b'trak', b'edts', b'mdia', b'minf', b'stbl'}
+MAX_MOOV_SIZE = 64 * 1024 * 1024  # hours of 60fps video fit in a few tens of MB
+
+
+class SeekIndexError(Exception):
+    """Raised when a file cannot be indexed"""
+
+
+def index_path_for(media_path):
+    """Hidden index file stored next to the media file"""
+    directory, filename = os.path.split(media_path)
+    return os.path.join(directory, f".{filename}.seekidx")
+
+
+def is_supported(filename):
+    """Check if a seek index can be built for this file type"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+# MP4 / ISO base media
+
+def _mp4_boxes(data, start=0, end=None):
+    """Yield (type, payload_start, payload_end) for boxes in a buffer"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            break
+        yield box_type, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _read_moov(f):
+    """Locate and read the moov box from a file, skipping over mdat"""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            break
+        if box_type == b'moov':
+            if size > MAX_MOOV_SIZE or pos + size > file_size:
+                raise SeekIndexError(f"Invalid moov box size {size}")
+            f.seek(pos + header_size)
+            return f.read(size - header_size)
+        pos += size
+    raise SeekIndexError("No moov box found")
+
+
+def _mp4_tracks(moov):
+    """Yield a dict of sample table boxes per track"""
+    for box_type, start, end in _mp4_boxes(moov):
+        if box_type != b'trak':
+            continue
+        boxes = {}
+        stack = [(start, end)]
+        while stack:
+            lo, hi = stack.pop()
+            for child, child_start, child_end in _mp4_boxes(moov, lo, hi):
+                if child in MP4_CONTAINERS:
+                    stack.append((child_start, child_end))
+                else:
+                    boxes[child] = moov[child_start:child_end]
+        yield boxes
+
+
+def _full_box_table(payload, fmt):
+    """Parse a full box with an entry count followed by fixed-size entries"""
+    count = struct.unpack_from('>I', payload, 4)[0]
+    entry = struct.Struct('>' + fmt)
+    return [entry.unpack_from(payload, 8 + i * entry.size) for i in range(count)]
+
+
+def _mp4_movie_timescale(moov):
+    """Timescale of the movie header, used by edit list durations"""
+    for box_type, start, end in _mp4_boxes(moov):
+        if box_type == b'mvhd':
+            return struct.unpack_from('>I', moov, start + (20 if moov[start] == 1 else 12))[0]
+    return 0
+
+
+def _mp4_edit_shift(elst, timescale, movie_timescale):
+    """
+    Return the seconds to add to media times to get presentation times.
+
+    Leading empty edits delay the track; the first non-empty edit says which
+    media time is shown first (e.g. the decoder delay added by B-frames).
+    """
+    if elst is None:
+        return 0.0
+    entry = struct.Struct('>Qq' if elst[0] == 1 else '>Ii')
+    delay = 0.0
+    for i in range(struct.unpack_from('>I', elst, 4)[0]):
+        duration, media_time = entry.unpack_from(elst, 8 + i * (entry.size + 4))
+        if media_time == -1:
+            if movie_timescale:
+                delay += duration / movie_timescale
+            continue
+        return delay - media_time / timescale
+    return delay
+
+
+def build_mp4_index(path):
+    """Return (times, offsets) for the keyframes of the first video track"""
+    with open(path, 'rb') as f:
+        moov = _read_moov(f)
+    movie_timescale = _mp4_movie_timescale(moov)
+
+    for boxes in _mp4_tracks(moov):
+        hdlr = boxes.get(b'hdlr')
+        if hdlr is None or hdlr[8:12] != b'vide':
+            continue
+
+        mdhd = boxes[b'mdhd']
+        if mdhd[0] == 1:
+            timescale = struct.unpack_from('>I', mdhd, 20)[0]
+        else:
+            timescale = struct.unpack_from('>I', mdhd, 12)[0]
+        if not timescale:
+            raise SeekIndexError("Invalid media timescale 0")
+        shift = _mp4_edit_shift(boxes.get(b'elst'), timescale, movie_timescale)
+
+        stts = _full_box_table(boxes[b'stts'], 'II')
+        stsc = _full_box_table(boxes[b'stsc'], 'III')
+        if b'co64' in boxes:
+            chunk_offsets = [o for (o,) in _full_box_table(boxes[b'co64'], 'Q')]
+        else:
+            chunk_offsets = [o for (o,) in _full_box_table(boxes[b'stco'], 'I')]
+
+        stsz = boxes[b'stsz']
+        uniform_size, sample_count = struct.unpack_from('>II', stsz, 4)
+        if uniform_size:
+            sample_sizes = None
+        else:
+            sample_sizes = struct.unpack_from(f'>{sample_count}I', stsz, 12)
+
+        if b'stss' in boxes:
+            sync = {s for (s,) in _full_box_table(boxes[b'stss'], 'I')}
+        else:
+            sync = None  # every sample is a sync sample
+
+        # Expand stts into per-sample decode times lazily while walking chunks;
+        # ctts holds each sample's composition (presentation) offset
+        durations = iter([delta for count, delta in stts for _ in range(count)])
+        if b'ctts' in boxes:
+            composition = iter([delta for count, delta in _full_box_table(boxes[b'ctts'], 'Ii')
+                                for _ in range(count)])
+        else:
+            composition = None
+        times = array('d')
+        offsets = array('Q')
+        sample = 1
+        decode_time = 0
+
+        for i, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+            last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunk_offsets)
+            for chunk in range(first_chunk, last_chunk + 1):
+                offset = chunk_offsets[chunk - 1]
+                for _ in range(samples_per_chunk):
+                    if sample > sample_count:
+                        break
+                    composition_offset = next(composition, 0) if composition else 0
+                    if sync is None or sample in sync:
+                        times.append(max((decode_time + composition_offset) / timescale + shift, 0.0))
+                        offsets.append(offset)
+                    offset += uniform_size or sample_sizes[sample - 1]
+                    decode_time += next(durations, 0)
+                    sample += 1
+
+        return times, offsets
+
+    raise SeekIndexError("No video track found")
+
+
+# Matroska / WebM
+
+MKV_SEGMENT = 0x18538067
+MKV_SEEK_HEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_CUES = 0x1C53BB6B
+MKV_CUE_POINT = 0xBB
+MKV_CUE_TIME = 0xB3
+MKV_CUE_TRACK_POSITIONS = 0xB7
+MKV_CUE_CLUSTER_POSITION = 0xF1
+MKV_CLUSTER = 0x1F43B675
+
+MKV_UNKNOWN_SIZE = -1
+
+
+def _ebml_vint(data, pos, keep_marker):
+    """Read an EBML variable length integer, returning (value, new_pos)"""
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise SeekIndexError("Invalid EBML integer")
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = value == mask - 1
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+    if not keep_marker and all_ones:
+        return MKV_UNKNOWN_SIZE, pos + length
+    return value, pos + length
+
+
+def _ebml_elements(data, start=0, end=None):
+    """Yield (id, payload_start, payload_end) for elements in a buffer"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos < end:
+        element_id, pos = _ebml_vint(data, pos, True)
+        size, pos = _ebml_vint(data, pos, False)
+        stop = end if size == MKV_UNKNOWN_SIZE else min(pos + size, end)
+        yield element_id, pos, stop
+        pos = stop
+
+
+def _ebml_uint(data, start, end):
+    return int.from_bytes(data[start:end], 'big')
+
+
+def _read_element_header(f, pos):
+    """Read an element header from a file, returning (id, size, payload_pos)"""
+    f.seek(pos)
+    header = f.read(12)
+    if len(header) < 2:
+        return None
+    element_id, offset = _ebml_vint(header, 0, True)
+    size, offset = _ebml_vint(header, offset, False)
+    return element_id, size, pos + offset
+
+
+def build_mkv_index(path):
+    """Return (times, offsets) from the Matroska Cues element"""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        # Skip the EBML header to reach the Segment
+        pos = 0
+        while True:
+            header = _read_element_header(f, pos)
+            if header is None:
+                raise SeekIndexError("No Segment element found")
+            element_id, size, payload = header
+            if element_id == MKV_SEGMENT:
+                break
+            pos = payload + size
+
+        segment_start = payload
+        segment_end = file_size if size == MKV_UNKNOWN_SIZE else min(payload + size, file_size)
+        timecode_scale = 1000000
+        cues_position = None
+        cues = None
+
+        pos = segment_start
+        while pos < segment_end and cues is None:
+            header = _read_element_header(f, pos)
+            if header is None:
+                break
+            element_id, size, payload = header
+            if size == MKV_UNKNOWN_SIZE:
+                if cues_position is None:
+                    break  # Live-style stream without a seek head
+                if cues_position <= pos:
+                    # A SeekHead pointing back (or at this element) would loop forever
+                    raise SeekIndexError("Cues position does not follow an element of unknown size")
+                pos = cues_position
+                continue
+
+            if element_id in (MKV_SEEK_HEAD, MKV_INFO, MKV_CUES):
+                f.seek(payload)
+                data = f.read(size)
+                if element_id == MKV_CUES:
+                    cues = data
+                elif element_id == MKV_INFO:
+                    for child, lo, hi in _ebml_elements(data):
+                        if child == MKV_TIMECODE_SCALE:
+                            timecode_scale = _ebml_uint(data, lo, hi)
+                else:
+                    for seek, lo, hi in _ebml_elements(data):
+                        if seek != MKV_SEEK:
+                            continue
+                        seek_id = seek_position = None
+                        for child, clo, chi in _ebml_elements(data, lo, hi):
+                            if child == MKV_SEEK_ID:
+                                seek_id = _ebml_uint(data, clo, chi)
+                            elif child == MKV_SEEK_POSITION:
+                                seek_position = _ebml_uint(data, clo, chi)
+                        if seek_id == MKV_CUES and seek_position is not None:
+                            cues_position = segment_start + seek_position
+
+            if element_id == MKV_CLUSTER and cues_position is not None and cues_position > pos:
+                # Jump straight over the media data to the Cues
+                pos = cues_position
+            else:
+                pos = payload + size
+
+    if cues is None:
+        raise SeekIndexError("No Cues element found")
+
+    times = array('d')
+    offsets = array('Q')
+    for element_id, lo, hi in _ebml_elements(cues):
+        if element_id != MKV_CUE_POINT:
+            continue
+        cue_time = None
+        cluster_position = None
+        for child, clo, chi in _ebml_elements(cues, lo, hi):
+            if child == MKV_CUE_TIME:
+                cue_time = _ebml_uint(cues, clo, chi)
+            elif child == MKV_CUE_TRACK_POSITIONS and cluster_position is None:
+                for track_child, tlo, thi in _ebml_elements(cues, clo, chi):
+                    if track_child == MKV_CUE_CLUSTER_POSITION:
+                        cluster_position = _ebml_uint(cues, tlo, thi)
+        if cue_time is not None and cluster_position is not None:
+            times.append(cue_time * timecode_scale / 1e9)
+            offsets.append(segment_start + cluster_position)
+
+    return times, offsets
+
+
+# Index files
+
+def build_index(media_path):
+    """Build and write the seek index for a media file"""
+    stat = os.stat(media_path)
+    extension = media_path.rsplit('.', 1)[-1].lower()
+    if extension in MP4_EXTENSIONS:
+        times, offsets = build_mp4_index(media_path)
+    elif extension in MKV_EXTENSIONS:
+        times, offsets = build_mkv_index(media_path)
+    else:
+        raise SeekIndexError(f"Unsupported file type: {extension}")
+
+    if not times:
+        raise SeekIndexError("No keyframes found")
+
+    if sys.byteorder == 'big':
+        times.byteswap()
+        offsets.byteswap()
+
+    index_path = index_path_for(media_path)
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, stat.st_size,
+                                  stat.st_mtime_ns, len(times)))
+        times.tofile(f)
+        offsets.tofile(f)
+    os.replace(temp_path, index_path)
+    return len(times)
+
+
+@lru_cache(maxsize=64)
+def _load_index(index_path, index_mtime_ns, size, mtime_ns):
+    """Load an index file; cached per index and source file version"""
+    with open(index_path, 'rb') as f:
+        magic, version, source_size, source_mtime, count = \
+            INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            return None
+        if source_size != size or source_mtime != mtime_ns:
+            return None  # Media changed since the index was built
+        times = array('d')
+        offsets = array('Q')
+        times.fromfile(f, count)
+        offsets.fromfile(f, count)
+    if sys.byteorder == 'big':
+        times.byteswap()
+        offsets.byteswap()
+    return times, offsets
+
+
+def load_index(media_path):
+    """Return (times, offsets) for a media file, or None if missing or stale"""
+    try:
+        stat = os.stat(media_path)
+        index_path = index_path_for(media_path)
+        return _load_index(index_path, os.stat(index_path).st_mtime_ns,
+                           stat.st_size, stat.st_mtime_ns)
+    except (OSError, EOFError, struct.error):
+        return None
+
+
+def seek_range(media_path, index, t):
+    """Return (keyframe_time, start, end) of the keyframe at or before t"""
+    times, offsets = index
+    i = max(bisect.bisect_right(times, t) - 1, 0)
+    start = offsets[i]
+    end = os.path.getsize(media_path) - 1
+    for j in range(i + 1, len(offsets)):
+        if offsets[j] > start:
+            end = offsets[j] - 1
+            break
+    return times[i], start, end
+
+
+class SeekIndexer(FileWorker):
+    """Background thread that builds seek indexes one file at a time"""
+
+    name = 'seek-indexer'
+    description = 'Seek index'
+
+    def submit(self, media_path):
+        """Queue a file for indexing if it is supported and not queued already"""
+        if is_supported(media_path):
+            super().submit(media_path)
+
+    def process(self, media_path):
+        if load_index(media_path) is None:
+            count = build_index(media_path)
+            logger.info(f"Seek index built: {os.path.basename(media_path)} ({count} keyframes)")
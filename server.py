@@ -8,16 +8,29 @@ import os
 import sys
 import logging
 from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+from flask import Flask, Response, request, jsonify, redirect, send_from_directory, render_template_string
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import threading
 import time
+import urllib.error
+
+from archive import ArchiveEntry, build_archive
+import seek_index
+from replication import LOCAL_PARAM, READ_SIZE, Replicator
+from profiler import RequestTimings, SamplingProfiler, close_after_body
+import listing
+from durability import MODES as DURABILITY_MODES, DurabilityPolicy
 
 # Configuration
 UPLOAD_FOLDER = '/media/soulstream'
 ALLOWED_EXTENSIONS = {'mp4', 'mkv', 'avi', 'mov', 'wmv', 'flv', 'webm'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024 * 1024  # 16GB max file size
+REPLICA_MODE = 'redirect'  # How reads are sent to a peer: 'redirect' or 'proxy'
+SLOW_REQUEST_SECONDS = 1.0  # Requests slower than this are kept in /admin/timings
+# 'none', 'on-complete' or 'group-commit' (see durability.py for what an acknowledgement guarantees)
+DURABILITY_MODE = 'on-complete'
+
 
 # Setup logging
 logging.basicConfig(
@@ -37,6 +50,20 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 # Enable CORS for all routes
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Builds keyframe seek indexes in the background
+seek_indexer = seek_index.SeekIndexer()
+
+# Peer replication, created by start_server()
+replicator = None
+
+# When uploads are forced to disk; replaced by --durability
+durability = DurabilityPolicy(DURABILITY_MODE)
+
+# Request phase timings and the on-demand sampling profiler
+timings = RequestTimings(SLOW_REQUEST_SECONDS)
+timings.install(app)
+profiler = SamplingProfiler()
+
 def allowed_file(filename):
     """Check if the file extension is allowed"""
     return '.' in filename and \
@@ -53,18 +80,33 @@ def ensure_upload_directory():
             return False
     return True
 
+def format_size(size):
+    """Format a size in bytes in human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} PB"
+
 def get_file_size(file_path):
     """Get file size in human readable format"""
     try:
-        size = os.path.getsize(file_path)
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size < 1024.0:
-                return f"{size:.2f} {unit}"
-            size /= 1024.0
-        return f"{size:.2f} PB"
+        return format_size(os.path.getsize(file_path))
     except OSError:
         return "Unknown"
 
+def iter_media_files():
+    """Yield (filename, stat) for media files without building a list"""
+    if not os.path.exists(UPLOAD_FOLDER):
+        return
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        for entry in entries:
+            if allowed_file(entry.name):
+                try:
+                    yield entry.name, entry.stat()
+                except OSError:
+                    continue
+
 @app.route('/')
 def index():
     """Serve the main upload page"""
@@ -149,12 +191,14 @@ def serve_static(filename):
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file upload"""
+    timer = timings.start_request('upload')
     try:
-        # Check if file was uploaded
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['file']
+        # Check if file was uploaded (first access parses the multipart body)
+        with timer.phase('parse'):
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file provided'}), 400
+            
+            file = request.files['file']
         
         # Check if file was selected
         if file.filename == '':
@@ -169,26 +213,42 @@ def upload_file():
             return jsonify({'error': 'Failed to create upload directory'}), 500
         
         # Secure the filename
-        filename = secure_filename(file.filename)
+        with timer.phase('sanitize'):
+            filename = secure_filename(file.filename)
         
         # Add timestamp to prevent overwrites
         name, ext = os.path.splitext(filename)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{name}_{timestamp}{ext}"
+        timer.detail = filename
         
         file_path = os.path.join(UPLOAD_FOLDER, filename)
         
-        # Save the file
-        file.save(file_path)
+        # Save under a temporary name; durability.complete() syncs it as the
+        # mode requires and renames it into place, so no reader (the seek
+        # indexer, replication, downloads) ever sees a partial file
+        temp_path = f"{file_path}.part"
+        with timer.phase('write'):
+            file.save(temp_path)
+        with timer.phase('fsync'):
+            durable = durability.complete(temp_path, file_path)
         
         # Log the upload
-        file_size = get_file_size(file_path)
-        logger.info(f"File uploaded: {filename} ({file_size})")
+        with timer.phase('stat'):
+            file_size = get_file_size(file_path)
+        with timer.phase('log'):
+            logger.info(f"File uploaded: {filename} ({file_size})")
+        
+        seek_indexer.submit(file_path)
+        if replicator is not None:
+            replicator.file_added(filename)
         
         return jsonify({
             'message': 'File uploaded successfully',
             'filename': filename,
-            'size': file_size
+            'size': file_size,
+            'durability': durability.mode,
+            'durable': durable
         }), 200
         
     except Exception as e:
@@ -198,23 +258,49 @@ def upload_file():
 @app.route('/files')
 def list_files():
     """List all uploaded files"""
+    timer = timings.start_request('list')
     try:
+        # Streaming formats for large catalogs; plain JSON stays the default
+        output = listing.negotiate()
+        if output == listing.NDJSON_MIMETYPE:
+            timer.detail = output
+            return listing.streaming_response(output, listing.stream_ndjson(
+                {
+                    'name': filename,
+                    'size': format_size(stat.st_size),
+                    'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                }
+                for filename, stat in iter_media_files()
+            ))
+        if output == listing.LISTING_BINARY_MIMETYPE:
+            timer.detail = output
+            return listing.streaming_response(output, listing.stream_binary(
+                (filename, stat.st_size, stat.st_mtime) for filename, stat in iter_media_files()
+            ))
+        
         files = []
         if os.path.exists(UPLOAD_FOLDER):
-            for filename in os.listdir(UPLOAD_FOLDER):
-                if allowed_file(filename):
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    try:
-                        stat = os.stat(file_path)
-                        files.append({
-                            'name': filename,
-                            'size': get_file_size(file_path),
-                            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
-                        })
-                    except OSError:
-                        continue
+            with timer.phase('scan'):
+                filenames = os.listdir(UPLOAD_FOLDER)
+            with timer.phase('stat'):
+                for filename in filenames:
+                    if allowed_file(filename):
+                        file_path = os.path.join(UPLOAD_FOLDER, filename)
+                        try:
+                            stat = os.stat(file_path)
+                            files.append({
+                                'name': filename,
+                                'size': format_size(stat.st_size),
+                                'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                            })
+                        except OSError:
+                            continue
         
-        return jsonify({'files': files})
+        timer.detail = f"{len(files)} files"
+        with timer.phase('serialize'):
+            response = jsonify({'files': files})
+        response.vary.add('Accept')
+        return response
         
     except Exception as e:
         logger.error(f"Error listing files: {str(e)}")
@@ -223,20 +309,269 @@ def list_files():
 @app.route('/files/<filename>')
 def serve_file(filename):
     """Serve a specific file"""
+    timer = timings.start_request('serve')
+    timer.detail = filename
     try:
         if not allowed_file(filename):
             return jsonify({'error': 'File type not allowed'}), 400
         
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        # Send the read to a less busy replica unless a peer asked for our copy
+        if replicator is not None and LOCAL_PARAM not in request.args:
+            with timer.phase('route'):
+                peer = replicator.choose_replica(filename)
+            if peer is not None:
+                if REPLICA_MODE != 'proxy':
+                    return redirect(peer.file_url(filename))
+                response = proxy_from_peer(peer, filename)
+                if response is not None:
+                    return response
+        
+        with timer.phase('lookup'):
+            file_path = os.path.join(UPLOAD_FOLDER, filename)
+            
+            if not os.path.exists(file_path):
+                return jsonify({'error': 'File not found'}), 404
+            
+            response = send_from_directory(UPLOAD_FOLDER, filename)
+        if replicator is not None:
+            replicator.stream_started()
+            close_after_body(response, replicator.stream_finished)
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error serving file {filename}: {str(e)}")
+        return jsonify({'error': 'Failed to serve file'}), 500
+
+def proxy_from_peer(peer, filename):
+    """Stream a file from a peer through this server; None if the peer is unreachable"""
+    try:
+        upstream = replicator.open_from_peer(peer, filename, request.headers.get('Range'))
+    except urllib.error.HTTPError as e:
+        return Response(e.read(), status=e.code, mimetype=e.headers.get('Content-Type'))
+    except (urllib.error.URLError, OSError) as e:
+        # The peer went down since the last load poll; serve our own copy instead
+        replicator.peer_unreachable(peer, e)
+        return None
+    
+    def generate():
+        try:
+            while True:
+                data = upstream.read(READ_SIZE)
+                if not data:
+                    break
+                yield data
+        finally:
+            upstream.close()
+    
+    headers = {name: upstream.headers[name] for name in
+               ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified')
+               if upstream.headers.get(name)}
+    response = Response(generate(), status=upstream.status, headers=headers,
+                        mimetype=upstream.headers.get('Content-Type'), direct_passthrough=True)
+    replicator.stream_started()
+    close_after_body(response, replicator.stream_finished)
+    return response
+
+@app.route('/files/<filename>/seek')
+def seek_file(filename):
+    """Return the byte range of the keyframe at or before time t"""
+    try:
+        if not allowed_file(filename):
+            return jsonify({'error': 'File type not allowed'}), 400
+        
+        if not seek_index.is_supported(filename):
+            return jsonify({'error': 'Seek index not supported for this file type'}), 400
+        
+        try:
+            t = float(request.args.get('t', ''))
+        except ValueError:
+            return jsonify({'error': 'Invalid time'}), 400
+        
+        file_path = os.path.join(UPLOAD_FOLDER, secure_filename(filename))
         
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found'}), 404
         
-        return send_from_directory(UPLOAD_FOLDER, filename)
+        index = seek_index.load_index(file_path)
+        if index is None:
+            error = seek_indexer.failure(file_path)
+            if error:
+                return jsonify({'error': f'Seek index unavailable: {error}'}), 422
+            seek_indexer.submit(file_path)
+            return jsonify({'status': 'indexing', 'message': 'Seek index is being built, retry shortly'}), 202
+        
+        keyframe_time, start, end = seek_index.seek_range(file_path, index, max(t, 0.0))
+        return jsonify({
+            'time': keyframe_time,
+            'offset': start,
+            'end': end,
+            'range': f'bytes={start}-{end}'
+        })
         
     except Exception as e:
-        logger.error(f"Error serving file {filename}: {str(e)}")
-        return jsonify({'error': 'Failed to serve file'}), 500
+        logger.error(f"Error seeking in file {filename}: {str(e)}")
+        return jsonify({'error': 'Failed to seek'}), 500
+
+@app.route('/archive')
+def download_archive():
+    """Stream a ZIP or TAR archive of selected files, with Range support"""
+    try:
+        fmt = request.args.get('format', 'zip').lower()
+        selected = request.args.getlist('file')
+        prefix = request.args.get('prefix', '')
+        
+        if not selected and not prefix:
+            return jsonify({'error': 'No files selected'}), 400
+        
+        if os.path.exists(UPLOAD_FOLDER):
+            names = set(os.listdir(UPLOAD_FOLDER))
+        else:
+            names = set()
+        
+        if prefix:
+            wanted = {name for name in names if name.startswith(prefix)}
+        else:
+            wanted = set()
+        for filename in selected:
+            if filename not in names:
+                return jsonify({'error': f'File not found: {filename}'}), 404
+            wanted.add(filename)
+        
+        entries = []
+        for filename in wanted:
+            if allowed_file(filename):
+                entries.append(ArchiveEntry(filename, os.path.join(UPLOAD_FOLDER, filename)))
+        
+        if not entries:
+            return jsonify({'error': 'No matching files'}), 404
+        
+        try:
+            archive = build_archive(fmt, entries)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        etag = archive.etag
+        start, stop = 0, archive.length
+        status = 200
+        
+        # Only honour Range if the client still has the same archive layout
+        if_range = request.if_range
+        if (request.range and request.range.units == 'bytes'
+                and (if_range.etag is None and if_range.date is None or if_range.etag == etag)):
+            ranges = request.range.ranges
+            byte_range = request.range.range_for_length(archive.length)
+            # Multipart responses are not supported, so a satisfiable
+            # multi-range request gets the whole archive (RFC 7233 allows it)
+            satisfiable = any(first < 0 or first < archive.length for first, _ in ranges)
+            if not satisfiable or (len(ranges) == 1 and byte_range is None):
+                response = Response(status=416)
+                response.headers['Content-Range'] = f'bytes */{archive.length}'
+                return response
+            if byte_range is not None:
+                start, stop = byte_range
+                status = 206
+        
+        download_name = secure_filename(prefix) or 'soulstream'
+        response = Response(archive.iter_range(start, stop), status=status,
+                            mimetype=archive.mimetype, direct_passthrough=True)
+        response.content_length = stop - start
+        response.accept_ranges = 'bytes'
+        response.set_etag(etag)
+        response.headers['Content-Disposition'] = \
+            f'attachment; filename="{download_name}.{archive.extension}"'
+        if status == 206:
+            response.content_range = f'bytes {start}-{stop - 1}/{archive.length}'
+        
+        logger.info(f"Streaming {fmt} archive of {len(entries)} files "
+                    f"(bytes {start}-{stop - 1}/{archive.length})")
+        return response
+        
+    except Exception as e:
+        logger.error(f"Archive error: {str(e)}")
+        return jsonify({'error': 'Failed to build archive'}), 500
+
+@app.route('/replication/status')
+def replication_status():
+    """Current load and peer health"""
+    if replicator is None:
+        return jsonify({'error': 'Replication not enabled'}), 404
+    return jsonify(replicator.status())
+
+@app.route('/replication/catalog')
+def replication_catalog():
+    """File names and sizes held by this node, for peer catalog diffs"""
+    if replicator is None:
+        return jsonify({'error': 'Replication not enabled'}), 404
+    return jsonify({'active': replicator.active, 'files': replicator.local_catalog()})
+
+@app.route('/replication/files/<filename>', methods=['PUT'])
+def replication_receive(filename):
+    """Receive a file pushed by a peer"""
+    try:
+        if replicator is None:
+            return jsonify({'error': 'Replication not enabled'}), 404
+        
+        if not allowed_file(filename) or secure_filename(filename) != filename:
+            return jsonify({'error': 'File type not allowed'}), 400
+        
+        if request.content_length is None:
+            return jsonify({'error': 'Content-Length required'}), 411
+        
+        if not ensure_upload_directory():
+            return jsonify({'error': 'Failed to create upload directory'}), 500
+        
+        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        if os.path.exists(file_path):
+            if os.path.getsize(file_path) == request.content_length:
+                return jsonify({'message': 'File already present', 'filename': filename}), 200
+            # Only a configured peer may replace an existing file
+            if not replicator.is_peer_address(request.remote_addr):
+                return jsonify({'error': 'File already exists'}), 409
+        
+        if not replicator.receive(filename, request.stream, request.content_length):
+            return jsonify({'error': 'Incomplete transfer'}), 400
+        
+        logger.info(f"Replica received: {filename} ({get_file_size(file_path)})")
+        seek_indexer.submit(file_path)
+        
+        return jsonify({'message': 'File replicated successfully', 'filename': filename}), 201
+        
+    except Exception as e:
+        logger.error(f"Replication receive error: {str(e)}")
+        return jsonify({'error': 'Failed to receive file'}), 500
+
+@app.route('/admin/profile', methods=['POST'])
+def start_profile():
+    """Run the sampling profiler for the given number of seconds"""
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval_ms', 5)) / 1000.0
+    except ValueError:
+        return jsonify({'error': 'Invalid seconds or interval_ms'}), 400
+    
+    if seconds <= 0 or interval <= 0:
+        return jsonify({'error': 'Invalid seconds or interval_ms'}), 400
+    
+    if not profiler.start(seconds, interval):
+        return jsonify({'error': 'Profiler already running'}), 409
+    
+    logger.info(f"Sampling profiler started for {profiler.seconds}s")
+    return jsonify(profiler.status()), 202
+
+@app.route('/admin/profile')
+def get_profile():
+    """Profiler status, or its samples as collapsed stacks or a flamegraph"""
+    output = request.args.get('format', 'json')
+    if output == 'collapsed':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    if output == 'svg':
+        return Response(profiler.flamegraph(), mimetype='image/svg+xml')
+    return jsonify(profiler.status())
+
+@app.route('/admin/timings')
+def get_timings():
+    """Per-route phase timings and recent slow requests"""
+    return jsonify(timings.snapshot())
 
 @app.route('/health')
 def health_check():
@@ -259,13 +594,27 @@ def internal_error(e):
     logger.error(f"Internal server error: {str(e)}")
     return jsonify({'error': 'Internal server error'}), 500
 
-def start_server(host='0.0.0.0', port=8080, debug=False):
+def start_server(host='0.0.0.0', port=8080, debug=False, peers=()):
     """Start the Flask server"""
+    global replicator
+    
     logger.info(f"Starting SoulStream Media Server on {host}:{port}")
     logger.info(f"Upload folder: {UPLOAD_FOLDER}")
     
-    # Ensure upload directory exists
-    ensure_upload_directory()
+    # Ensure upload directory exists, then index existing files that have no seek index yet
+    if ensure_upload_directory():
+        try:
+            for filename in sorted(os.listdir(UPLOAD_FOLDER)):
+                file_path = os.path.join(UPLOAD_FOLDER, filename)
+                if allowed_file(filename) and seek_index.load_index(file_path) is None:
+                    seek_indexer.submit(file_path)
+        except OSError as e:
+            logger.error(f"Failed to scan upload directory for seek indexing: {e}")
+    
+    # Replication routes stay disabled (404) unless peers are configured
+    if peers:
+        replicator = Replicator(UPLOAD_FOLDER, peers, allowed_file)
+        replicator.start()
     
     app.run(host=host, port=port, debug=debug, threaded=True)
 
@@ -277,6 +626,14 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int, default=8080, help='Port to bind to')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     parser.add_argument('--upload-folder', default=UPLOAD_FOLDER, help='Upload folder path')
+    parser.add_argument('--peer', action='append', default=[],
+                        help='URL of a peer SoulStream server to replicate to (repeatable)')
+    parser.add_argument('--slow-request-seconds', type=float, default=SLOW_REQUEST_SECONDS,
+                        help='Requests slower than this are kept in /admin/timings')
+    parser.add_argument('--durability', choices=DURABILITY_MODES, default=DURABILITY_MODE,
+                        help='When uploads are forced to disk (see durability.py)')
+    parser.add_argument('--replica-mode', choices=['redirect', 'proxy'], default=REPLICA_MODE,
+                        help='How reads are sent to a less loaded peer')
     
     args = parser.parse_args()
     
@@ -285,4 +642,9 @@ if __name__ == '__main__':
         UPLOAD_FOLDER = args.upload_folder
         app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     
-    start_server(args.host, args.port, args.debug) 
\ No newline at end of file
+    REPLICA_MODE = args.replica_mode
+    if args.durability != DURABILITY_MODE:
+        durability = DurabilityPolicy(args.durability)
+    timings.slow_seconds = args.slow_request_seconds
+    
+    start_server(args.host, args.port, args.debug, args.peer) 
\ No newline at end of file
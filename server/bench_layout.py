@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark for SoulStream storage layouts
+Measures create, lookup and scan time for each layout at several library sizes.
+
+Run it on the target disk (ext4, exFAT, ...) since results depend heavily
+on the filesystem:
+
+    python3 bench_layout.py --dir /media/soulstream/bench --counts 10000 100000 1000000
+"""
+
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from storage_layout import LAYOUTS, create_layout, logical_name
+
+LOOKUP_SAMPLES = 10000
+
+
+def bench_layout(name, root, count):
+    """Return (create, lookup, scan) seconds for one layout and file count"""
+    layout = create_layout(name, root)
+    names = [(f"upload{i:07d}", f"movie{i:07d}.mp4") for i in range(count)]
+
+    start = time.perf_counter()
+    for upload_id, filename in names:
+        open(layout.path_for(upload_id, filename), 'wb').close()
+    create_time = time.perf_counter() - start
+
+    # Fresh instance so the index is read from disk as after a restart
+    layout = create_layout(name, root)
+    sample = random.sample(names, min(LOOKUP_SAMPLES, count))
+    start = time.perf_counter()
+    for upload_id, filename in sample:
+        assert layout.lookup(logical_name(upload_id, filename))
+    lookup_time = (time.perf_counter() - start) * count / len(sample)
+
+    start = time.perf_counter()
+    scanned = sum(1 for _ in layout.scan())
+    scan_time = time.perf_counter() - start
+    assert scanned == count
+
+    return create_time, lookup_time, scan_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SoulStream storage layouts')
+    parser.add_argument('--dir', default=None, help='Directory to benchmark in (default: temp dir)')
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Library sizes to test')
+    parser.add_argument('--layouts', nargs='+', default=sorted(LAYOUTS), help='Layouts to test')
+
+    args = parser.parse_args()
+
+    print(f"{'layout':<12} {'files':>9} {'create s':>10} {'lookup s':>10} {'scan s':>10}")
+    for count in args.counts:
+        for name in args.layouts:
+            root = tempfile.mkdtemp(prefix='soulstream-bench-', dir=args.dir)
+            try:
+                create_time, lookup_time, scan_time = bench_layout(name, root, count)
+                print(f"{name:<12} {count:>9} {create_time:>10.2f} {lookup_time:>10.2f} {scan_time:>10.2f}")
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+
+    print(f"\nlookup s is extrapolated from {LOOKUP_SAMPLES} random lookups to the full count")
+
+
+if __name__ == '__main__':
+    main()
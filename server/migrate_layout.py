@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Online migration from the upload-dir layout to the hashed layout
+
+Switch the upload server to STORAGE_LAYOUT = 'hashed' first, then run this
+while it keeps serving. Each file is recorded in the index before it is
+renamed into its shard, and lookups fall back to the old path until the
+rename lands, so every file stays reachable throughout. Renames stay on
+the same filesystem, so no data is copied.
+
+Chunk and .part files left behind by abandoned uploads are deleted once
+they are older than --min-age, so they cannot keep the migration from
+completing.
+"""
+
+import os
+import sys
+import time
+import argparse
+import logging
+
+from storage_layout import HashedLayout, MIGRATED_MARKER
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+
+def is_partial_upload(path):
+    """Chunk or temporary file of an upload that has not completed"""
+    return '.chunk_' in os.path.basename(path) or path.endswith('.part')
+
+
+def migrate(root, min_age=300, throttle=0.0, dry_run=False):
+    """Move every settled legacy file into the hashed layout"""
+    layout = HashedLayout(root)
+    moved = 0
+    skipped = 0
+    removed = 0
+    now = time.time()
+
+    for logical, path in list(layout.legacy.scan()):
+        try:
+            if now - os.path.getmtime(path) < min_age:
+                # Probably still being written by an in-flight upload
+                skipped += 1
+                continue
+        except OSError:
+            continue  # Deleted since the scan
+
+        if is_partial_upload(path):
+            # Left behind by an abandoned upload; it can never complete now
+            if dry_run:
+                logging.info(f"Would remove stale {path}")
+            else:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.warning(f"Could not remove {path}: {e}")
+                    skipped += 1
+                    continue
+                _remove_empty_dir(path)
+            removed += 1
+            continue
+
+        target = layout.physical_path(logical)
+        if dry_run:
+            logging.info(f"Would move {path} -> {target}")
+            moved += 1
+            continue
+
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            layout.register(logical, target)
+            os.rename(path, target)
+        except OSError as e:
+            # e.g. the file was deleted mid-run; a later run picks up the rest
+            logging.warning(f"Could not move {path}: {e}")
+            skipped += 1
+            continue
+        moved += 1
+
+        _remove_empty_dir(path)
+
+        if throttle:
+            time.sleep(throttle)
+
+    if not dry_run and skipped == 0:
+        open(os.path.join(layout.meta_dir, MIGRATED_MARKER), 'w').close()
+        logging.info("Migration complete, legacy fallback disabled")
+
+    logging.info(f"Moved {moved} files, removed {removed} stale partial files, skipped {skipped}")
+    return moved, skipped
+
+
+def _remove_empty_dir(path):
+    """Remove the upload directory that held path once it is empty"""
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass  # Directory still holds other files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate SoulStream uploads to the hashed layout')
+    parser.add_argument('--upload-folder', default='/media/soulstream', help='Upload folder path')
+    parser.add_argument('--min-age', type=int, default=300,
+                        help='Skip files modified less than this many seconds ago')
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help='Seconds to sleep between files to limit disk load')
+    parser.add_argument('--dry-run', action='store_true', help='Only print what would be moved')
+
+    args = parser.parse_args()
+    migrate(args.upload_folder, args.min_age, args.throttle, args.dry_run)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Storage layouts for the SoulStream upload server
+Maps logical upload names ("<upload_id>/<filename>") to paths on disk.
+
+upload-dir: the original layout, one directory per upload_id.
+hashed:     two-level fan-out (shards/ab/cd/...) keyed by a hash of the
+            logical name, with an append-only index so listings never walk
+            the directory tree.
+
+The hashed layout falls back to upload-dir paths for files that have not
+been migrated yet, so it can be switched on before migrate_layout.py has
+converted an existing library.
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+META_DIR = '.soulstream'
+SHARD_DIR = 'shards'
+INDEX_FILE = 'layout.idx'
+MIGRATED_MARKER = 'migrated'
+
+
+def logical_name(upload_id, filename):
+    """Logical name of an upload, independent of the on-disk layout"""
+    return f"{upload_id}/{filename}"
+
+
+class UploadDirLayout:
+    """One directory per upload_id (the original layout)"""
+
+    name = 'upload-dir'
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, upload_id, filename):
+        """Return the path to write an upload to, creating directories"""
+        upload_dir = os.path.join(self.root, upload_id)
+        os.makedirs(upload_dir, exist_ok=True)
+        return os.path.join(upload_dir, filename)
+
+    def lookup(self, logical):
+        """Return the path of an existing upload, or None"""
+        path = os.path.join(self.root, logical)
+        return path if os.path.isfile(path) else None
+
+    def scan(self):
+        """Yield (logical_name, path) for every stored file"""
+        for root, dirs, filenames in os.walk(self.root):
+            if root == self.root:
+                # Hashed layout directories are never upload_ids
+                dirs[:] = [d for d in dirs if d not in (META_DIR, SHARD_DIR)]
+            dirs.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(root, filename)
+                yield os.path.relpath(path, self.root).replace(os.sep, '/'), path
+
+
+class HashedLayout:
+    """Two-level hashed fan-out behind a logical-name index"""
+
+    name = 'hashed'
+
+    def __init__(self, root):
+        self.root = root
+        self.meta_dir = os.path.join(root, META_DIR)
+        self.index_path = os.path.join(self.meta_dir, INDEX_FILE)
+        self.legacy = UploadDirLayout(root)
+        self._index = {}
+        self._index_offset = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.meta_dir, exist_ok=True)
+
+    def physical_path(self, logical):
+        """Deterministic shard path for a logical name"""
+        digest = hashlib.sha1(logical.encode('utf-8')).hexdigest()
+        filename = logical.rsplit('/', 1)[-1]
+        return os.path.join(self.root, SHARD_DIR, digest[:2], digest[2:4],
+                            f"{digest[4:20]}_{filename}")
+
+    @property
+    def migrated(self):
+        """True once migrate_layout.py has moved every legacy file"""
+        return os.path.exists(os.path.join(self.meta_dir, MIGRATED_MARKER))
+
+    def _refresh(self):
+        """Read index records appended since the last refresh (caller holds lock)"""
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return
+        if size <= self._index_offset:
+            return
+
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            data = f.read(size - self._index_offset)
+
+        # Only consume complete lines; a concurrent writer may be mid-append
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            logical, relpath = json.loads(line)
+            self._index[logical] = relpath
+        self._index_offset += end
+
+    def register(self, logical, path):
+        """Record a logical name -> path mapping in the index"""
+        relpath = os.path.relpath(path, self.root)
+        with self._lock:
+            self._refresh()
+            if self._index.get(logical) == relpath:
+                return
+            record = json.dumps([logical, relpath]) + '\n'
+            # O_APPEND keeps single-line records from interleaving across processes
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(record)
+            self._index[logical] = relpath
+
+    def path_for(self, upload_id, filename):
+        """Return the path to write an upload to, creating directories"""
+        logical = logical_name(upload_id, filename)
+        path = self.physical_path(logical)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.register(logical, path)
+        return path
+
+    def lookup(self, logical):
+        """Return the path of an existing upload, or None"""
+        with self._lock:
+            self._refresh()
+            relpath = self._index.get(logical)
+        if relpath is not None:
+            path = os.path.join(self.root, relpath)
+            if os.path.isfile(path):
+                return path
+        return self.legacy.lookup(logical)
+
+    def scan(self):
+        """Yield (logical_name, path) for every stored file"""
+        with self._lock:
+            self._refresh()
+            index = dict(self._index)
+        migrated = self.migrated
+
+        for logical in sorted(index):
+            path = os.path.join(self.root, index[logical])
+            if not migrated and not os.path.isfile(path):
+                # Indexed by the migration tool but not renamed yet
+                path = self.legacy.lookup(logical) or path
+            yield logical, path
+
+        if not migrated:
+            for logical, path in self.legacy.scan():
+                if logical not in index:
+                    yield logical, path
+
+
+LAYOUTS = {
+    UploadDirLayout.name: UploadDirLayout,
+    HashedLayout.name: HashedLayout,
+}
+
+
+def create_layout(name, root):
+    """Create the storage layout registered under name"""
+    layout_class = LAYOUTS.get(name)
+    if layout_class is None:
+        raise ValueError(f"Unknown storage layout: {name}")
+    return layout_class(root)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+MPEG-TS scanner and byte-range HLS playlists for SoulStream
+Scans a TS file once, in a single streaming pass over its packets: PAT and
+PMT locate the video stream, random access points are taken from video PES
+starts, and PCR gives their timestamps. The result is cached as JSON and
+turned into an HLS playlist of EXT-X-BYTERANGE segments over the original
+file, so no transcoding or extra storage is needed.
+"""
+
+import os
+import json
+import math
+import logging
+
+from workers import FileWorker
+
+TS_EXTENSIONS = {'ts', 'mts', 'm2ts'}
+TS_SYNC = 0x47
+TS_PACKET_SIZE = 188
+READ_PACKETS = 4096
+SCAN_VERSION = 1
+
+TARGET_SEGMENT_DURATION = 6.0  # seconds
+
+PCR_CLOCK = 27000000
+PCR_WRAP = (1 << 33) * 300
+
+# PMT stream types carrying video
+VIDEO_STREAM_TYPES = {
+    0x01: 'mpeg1', 0x02: 'mpeg2', 0x10: 'mpeg4',
+    0x1B: 'h264', 0x24: 'hevc', 0xEA: 'vc1'
+}
+
+
+class TsScanError(Exception):
+    """Raised when a file cannot be scanned as MPEG-TS"""
+
+
+def is_ts_file(filename):
+    """Check if a file is an MPEG transport stream by extension"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in TS_EXTENSIONS
+
+
+def _check_packet_format(path):
+    """Make sure the file uses plain 188-byte TS packets"""
+    with open(path, 'rb') as f:
+        head = f.read(192 * 3 + 4)
+    if all(len(head) > i * 188 and head[i * 188] == TS_SYNC for i in range(3)):
+        return
+    if all(len(head) > 4 + i * 192 and head[4 + i * 192] == TS_SYNC for i in range(3)):
+        # BDAV M2TS prefixes each packet with a timestamp; HLS players expect plain TS
+        raise TsScanError("192-byte M2TS packets cannot be served as HLS segments")
+    raise TsScanError("No MPEG-TS sync bytes found")
+
+
+def _section(packet, start):
+    """
+    Return the PSI section carried in a packet payload and the end of its
+    entries (before the CRC), bounded by section_length so stuffing bytes
+    after the section are never parsed as entries.
+    """
+    pointer = packet[start]
+    section = packet[start + 1 + pointer:]
+    if len(section) < 3:
+        return section, 0
+    section_length = (section[1] & 0x0F) << 8 | section[2]
+    return section, min(3 + section_length, len(section)) - 4
+
+
+def _find_sync(block, start):
+    """Return the next offset whose sync byte repeats at packet spacing, or None"""
+    pos = block.find(b'\x47', start)
+    while pos != -1 and pos + 2 * TS_PACKET_SIZE < len(block):
+        if block[pos + TS_PACKET_SIZE] == TS_SYNC and block[pos + 2 * TS_PACKET_SIZE] == TS_SYNC:
+            return pos
+        pos = block.find(b'\x47', pos + 1)
+    return None
+
+
+def _is_keyframe(stream_type, payload):
+    """Look for a keyframe start code in the first bytes of a video PES"""
+    if len(payload) < 9 or payload[:3] != b'\x00\x00\x01':
+        return False
+    es = payload[9 + payload[8]:]
+    pos = es.find(b'\x00\x00\x01')
+    while 0 <= pos < len(es) - 4:
+        code = es[pos + 3]
+        if stream_type == 'h264' and code & 0x1F in (5, 7):
+            return True
+        if stream_type == 'hevc' and (code >> 1) & 0x3F in (16, 17, 18, 19, 20, 21, 32, 33):
+            return True
+        if stream_type in ('mpeg1', 'mpeg2', 'vc1') and code in (0xB3, 0x0F):
+            return True
+        if stream_type == 'mpeg4' and (code == 0xB0 or (code == 0xB6 and es[pos + 4] >> 6 == 0)):
+            return True
+        pos = es.find(b'\x00\x00\x01', pos + 3)
+    return False
+
+
+def scan_ts(path):
+    """
+    Scan a transport stream once and return its random access points.
+
+    Returns a dict with the video codec, a list of [segment_offset, seconds]
+    pairs (seconds relative to the first PCR) and the final PCR time.
+    Segment offsets are moved back to the PAT preceding each random access
+    point when there is one, so every segment starts with PAT/PMT.
+    """
+    _check_packet_format(path)
+    stat = os.stat(path)
+
+    pmt_pid = None
+    pcr_pid = None
+    video_pid = None
+    video_type = None
+
+    first_pcr = None
+    last_pcr = None
+    pcr_base = 0
+    last_pat_offset = -1
+    last_point_offset = -1
+    points = []
+
+    with open(path, 'rb') as f:
+        offset = 0
+        while True:
+            f.seek(offset)
+            block = f.read(TS_PACKET_SIZE * READ_PACKETS)
+            if len(block) < TS_PACKET_SIZE:
+                break
+            at_end = len(block) < TS_PACKET_SIZE * READ_PACKETS
+
+            cursor = 0
+            while cursor + TS_PACKET_SIZE <= len(block):
+                pos = cursor
+                if block[pos] != TS_SYNC:
+                    # Lost sync (e.g. a dropped byte): realign on the next sync
+                    # byte that repeats at packet spacing
+                    sync = _find_sync(block, pos + 1)
+                    if sync is not None:
+                        cursor = sync
+                        continue
+                    if at_end:
+                        cursor = len(block)
+                        break
+                    # Search the unchecked tail again with the next read
+                    cursor = max(pos + 1, len(block) - 2 * TS_PACKET_SIZE)
+                    break
+                cursor += TS_PACKET_SIZE
+
+                pid = ((block[pos + 1] & 0x1F) << 8) | block[pos + 2]
+                if pid not in (0, pmt_pid, pcr_pid, video_pid):
+                    continue
+
+                packet_offset = offset + pos
+                pusi = block[pos + 1] & 0x40
+                control = block[pos + 3] >> 4 & 0x3
+                payload_start = pos + 4
+                random_access = False
+
+                if control & 0x2:
+                    length = block[pos + 4]
+                    payload_start += 1 + length
+                    if length:
+                        flags = block[pos + 5]
+                        random_access = bool(flags & 0x40)
+                        if flags & 0x10 and pid == pcr_pid and length >= 7:
+                            p = block[pos + 6:pos + 12]
+                            pcr = ((p[0] << 25 | p[1] << 17 | p[2] << 9 | p[3] << 1 | p[4] >> 7) * 300
+                                   + ((p[4] & 0x1) << 8 | p[5]))
+                            if last_pcr is not None and pcr + pcr_base < last_pcr - PCR_WRAP // 2:
+                                pcr_base += PCR_WRAP
+                            last_pcr = pcr + pcr_base
+                            if first_pcr is None:
+                                first_pcr = last_pcr
+
+                if not control & 0x1 or not pusi or payload_start >= pos + TS_PACKET_SIZE:
+                    continue
+                packet = block[pos:pos + TS_PACKET_SIZE]
+                payload_start -= pos
+
+                if pid == 0:
+                    section, entries_end = _section(packet, payload_start)
+                    last_pat_offset = packet_offset
+                    for i in range(8, entries_end - 3, 4):
+                        program = section[i] << 8 | section[i + 1]
+                        if program:
+                            pmt_pid = (section[i + 2] & 0x1F) << 8 | section[i + 3]
+                            break
+                elif pid == pmt_pid and video_pid is None:
+                    section, entries_end = _section(packet, payload_start)
+                    if entries_end < 12:
+                        continue
+                    pcr_pid = (section[8] & 0x1F) << 8 | section[9]
+                    i = 12 + ((section[10] & 0x0F) << 8 | section[11])
+                    while i + 5 <= entries_end:
+                        stream_type = section[i]
+                        if stream_type in VIDEO_STREAM_TYPES:
+                            video_pid = (section[i + 1] & 0x1F) << 8 | section[i + 2]
+                            video_type = VIDEO_STREAM_TYPES[stream_type]
+                            break
+                        i += 5 + ((section[i + 3] & 0x0F) << 8 | section[i + 4])
+                elif pid == video_pid and last_pcr is not None:
+                    if random_access or _is_keyframe(video_type, packet[payload_start:]):
+                        if last_pat_offset > last_point_offset:
+                            segment_offset = last_pat_offset
+                        else:
+                            segment_offset = packet_offset
+                        points.append([segment_offset, (last_pcr - first_pcr) / PCR_CLOCK])
+                        last_point_offset = packet_offset
+
+            if at_end and cursor + TS_PACKET_SIZE > len(block):
+                break
+            offset += cursor
+
+    if video_pid is None:
+        raise TsScanError("No video stream found")
+    if not points:
+        raise TsScanError("No random access points found")
+
+    return {
+        'version': SCAN_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'video': video_type,
+        'points': points,
+        'end_time': (last_pcr - first_pcr) / PCR_CLOCK
+    }
+
+
+def load_scan(cache_path, media_path):
+    """Return the cached scan, or None if missing or the file has changed"""
+    try:
+        stat = os.stat(media_path)
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            scan = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (scan.get('version') != SCAN_VERSION or scan.get('size') != stat.st_size
+            or scan.get('mtime_ns') != stat.st_mtime_ns):
+        return None
+    return scan
+
+
+def save_scan(cache_path, scan):
+    """Write a scan result atomically"""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(scan, f, separators=(',', ':'))
+    os.replace(temp_path, cache_path)
+
+
+def build_playlist(scan, uri, target_duration=TARGET_SEGMENT_DURATION):
+    """Build a VOD HLS playlist of byte-range segments over one file"""
+    points = scan['points']
+
+    # Group random access points into segments of about target_duration;
+    # the first segment also carries any data before the first point
+    boundaries = [[0, points[0][1]]]
+    for point in points[1:]:
+        if point[1] - boundaries[-1][1] >= target_duration and point[0] > boundaries[-1][0]:
+            boundaries.append(point)
+
+    segments = []
+    for i, (start, time) in enumerate(boundaries):
+        if i + 1 < len(boundaries):
+            end, next_time = boundaries[i + 1]
+        else:
+            end, next_time = scan['size'], scan['end_time']
+        segments.append((start, end - start, max(next_time - time, 0.0)))
+
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:4',
+        f"#EXT-X-TARGETDURATION:{max(1, math.ceil(max(s[2] for s in segments)))}",
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    for start, length, duration in segments:
+        lines.append(f"#EXTINF:{duration:.3f},")
+        lines.append(f"#EXT-X-BYTERANGE:{length}@{start}")
+        lines.append(uri)
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+class TsScanner(FileWorker):
+    """Background thread that scans TS files one at a time"""
+
+    name = 'ts-scanner'
+    description = 'TS scan'
+
+    def submit(self, media_path, cache_path):
+        """Queue a scan unless one is pending or already failed for this file version"""
+        super().submit(media_path, cache_path)
+
+    def process(self, media_path, cache_path):
+        if load_scan(cache_path, media_path) is None:
+            scan = scan_ts(media_path)
+            save_scan(cache_path, scan)
+            logging.info(f"TS scan complete: {os.path.basename(media_path)} "
+                         f"({len(scan['points'])} random access points)")
@@ -7,12 +7,24 @@ Handles file uploads from the Flutter app
 import os
 import sys
 import json
+import hashlib
 import shutil
 from pathlib import Path
-from flask import Flask, request, jsonify
+from urllib.parse import quote
+from flask import Flask, Response, request, jsonify, send_file
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 import logging
 
+# Modules shared with the media server (server.py) live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage_layout import META_DIR, create_layout, logical_name
+from durability import DurabilityPolicy
+import ts_index
+from profiler import RequestTimings
+import listing
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -32,9 +44,25 @@ ALLOWED_EXTENSIONS = {
     '3gp', 'ts', 'mts', 'm2ts', 'vob', 'ogv', 'mxf', 'asf'
 }
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024 * 1024  # 16GB max file size
+# 'upload-dir' (one directory per upload_id) or 'hashed' (sharded, see migrate_layout.py)
+STORAGE_LAYOUT = 'upload-dir'
+# 'none', 'on-complete' or 'group-commit' (see durability.py for what an acknowledgement guarantees)
+DURABILITY_MODE = 'on-complete'
+GROUP_COMMIT_INTERVAL = 0.05  # seconds
+SLOW_REQUEST_SECONDS = 1.0  # Uploads slower than this are kept in /admin/timings
+
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+layout = create_layout(STORAGE_LAYOUT, UPLOAD_FOLDER)
+durability = DurabilityPolicy(DURABILITY_MODE, GROUP_COMMIT_INTERVAL)
+
+# Scans TS uploads for HLS playlists in the background
+ts_scanner = ts_index.TsScanner()
+
+# Upload phase timings (parse, write, fsync, respond)
+timings = RequestTimings(SLOW_REQUEST_SECONDS)
+timings.install(app)
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -43,20 +71,35 @@ def allowed_file(filename):
 
 def get_file_path(filename, upload_id):
     """Generate file path for upload"""
-    # Create directory for upload ID if it doesn't exist
-    upload_dir = os.path.join(UPLOAD_FOLDER, upload_id)
-    os.makedirs(upload_dir, exist_ok=True)
-    return os.path.join(upload_dir, filename)
+    return layout.path_for(upload_id, filename)
+
+def resolve_media(name):
+    """Return the path of a stored upload by logical name, or None"""
+    if not allowed_file(name) or safe_join(UPLOAD_FOLDER, name) is None:
+        return None
+    return layout.lookup(name)
+
+def hls_cache_path(name):
+    """Location of the cached TS scan for a logical name"""
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return os.path.join(UPLOAD_FOLDER, META_DIR, 'hls', f"{digest}.json")
+
+def upload_complete(filename, upload_id, file_path):
+    """Post-processing for a fully received upload"""
+    if ts_index.is_ts_file(filename):
+        ts_scanner.submit(file_path, hls_cache_path(logical_name(upload_id, filename)))
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file upload"""
+    timer = timings.start_request('upload')
     try:
-        # Check if file is present
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['file']
+        # Check if file is present (first access parses the multipart body)
+        with timer.phase('parse'):
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file provided'}), 400
+            
+            file = request.files['file']
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
@@ -75,6 +118,7 @@ def upload_file():
         
         # Get file path
         file_path = get_file_path(filename, upload_id)
+        timer.detail = f"{upload_id}/{filename}"
         
         # Handle chunked upload
         if total_chunks > 1:
@@ -82,39 +126,62 @@ def upload_file():
             chunk_path = f"{file_path}.chunk_{chunk_index}"
             
             # Save chunk
-            file.save(chunk_path)
+            with timer.phase('write'):
+                file.save(chunk_path)
+            with timer.phase('fsync'):
+                durable = durability.chunk_written(chunk_path)
             
             # If this is the last chunk, combine all chunks
             if chunk_index == total_chunks - 1:
                 logging.info(f"Combining {total_chunks} chunks for {filename}")
                 
-                with open(file_path, 'wb') as outfile:
-                    for i in range(total_chunks):
-                        chunk_file = f"{file_path}.chunk_{i}"
-                        if os.path.exists(chunk_file):
-                            with open(chunk_file, 'rb') as infile:
-                                shutil.copyfileobj(infile, outfile)
-                            os.remove(chunk_file)  # Clean up chunk file
+                temp_path = f"{file_path}.part"
+                chunk_files = [f"{file_path}.chunk_{i}" for i in range(total_chunks)]
+                with timer.phase('write'):
+                    with open(temp_path, 'wb') as outfile:
+                        for chunk_file in chunk_files:
+                            if os.path.exists(chunk_file):
+                                with open(chunk_file, 'rb') as infile:
+                                    shutil.copyfileobj(infile, outfile)
+                
+                with timer.phase('fsync'):
+                    durable = durability.complete(temp_path, file_path)
+                # Chunks are only removed once the combined file is in place
+                for chunk_file in chunk_files:
+                    if os.path.exists(chunk_file):
+                        os.remove(chunk_file)  # Clean up chunk file
                 
+                upload_complete(filename, upload_id, file_path)
                 logging.info(f"File {filename} uploaded successfully")
                 return jsonify({
                     'message': 'File uploaded successfully',
                     'filename': filename,
-                    'size': os.path.getsize(file_path)
+                    'size': os.path.getsize(file_path),
+                    'durability': durability.mode,
+                    'durable': durable
                 })
             else:
                 return jsonify({
                     'message': f'Chunk {chunk_index + 1}/{total_chunks} uploaded',
-                    'chunk_index': chunk_index
+                    'chunk_index': chunk_index,
+                    'durability': durability.mode,
+                    'durable': durable
                 })
         else:
             # Single file upload
-            file.save(file_path)
+            temp_path = f"{file_path}.part"
+            with timer.phase('write'):
+                file.save(temp_path)
+            with timer.phase('fsync'):
+                durable = durability.complete(temp_path, file_path)
+            upload_complete(filename, upload_id, file_path)
             logging.info(f"File {filename} uploaded successfully")
             return jsonify({
                 'message': 'File uploaded successfully',
                 'filename': filename,
-                'size': os.path.getsize(file_path)
+                'size': os.path.getsize(file_path),
+                'durability': durability.mode,
+                'durable': durable
             })
     
     except Exception as e:
@@ -131,12 +198,10 @@ def server_status():
         # Count files in upload directory
         file_count = 0
         total_size = 0
-        for root, dirs, files in os.walk(UPLOAD_FOLDER):
-            file_count += len(files)
-            for file in files:
-                file_path = os.path.join(root, file)
-                if os.path.isfile(file_path):
-                    total_size += os.path.getsize(file_path)
+        for name, file_path in layout.scan():
+            if os.path.isfile(file_path):
+                file_count += 1
+                total_size += os.path.getsize(file_path)
         
         return jsonify({
             'status': 'running',
@@ -152,29 +217,98 @@ def server_status():
         logging.error(f"Status error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def iter_stored_files():
+    """Yield (logical_name, path, stat) for stored files without building a list"""
+    for name, file_path in layout.scan():
+        try:
+            yield name, file_path, os.stat(file_path)
+        except OSError:
+            continue
+
 @app.route('/files', methods=['GET'])
 def list_files():
     """List uploaded files"""
     try:
+        # Streaming formats for large catalogs; plain JSON stays the default.
+        # Unlike the plain JSON listing, both streaming formats carry the
+        # logical name (<upload_id>/<filename>) used by /media
+        output = listing.negotiate()
+        if output == listing.NDJSON_MIMETYPE:
+            return listing.streaming_response(output, listing.stream_ndjson(
+                {'name': name, 'path': file_path, 'size': stat.st_size, 'modified': stat.st_mtime}
+                for name, file_path, stat in iter_stored_files()
+            ))
+        if output == listing.LISTING_BINARY_MIMETYPE:
+            return listing.streaming_response(output, listing.stream_binary(
+                (name, stat.st_size, stat.st_mtime) for name, _, stat in iter_stored_files()
+            ))
+        
         files = []
-        for root, dirs, filenames in os.walk(UPLOAD_FOLDER):
-            for filename in filenames:
-                file_path = os.path.join(root, filename)
-                if os.path.isfile(file_path):
-                    stat = os.stat(file_path)
-                    files.append({
-                        'name': filename,
-                        'path': file_path,
-                        'size': stat.st_size,
-                        'modified': stat.st_mtime
-                    })
+        for name, file_path in layout.scan():
+            if os.path.isfile(file_path):
+                stat = os.stat(file_path)
+                files.append({
+                    'name': os.path.basename(name),
+                    'path': file_path,
+                    'size': stat.st_size,
+                    'modified': stat.st_mtime
+                })
         
-        return jsonify({'files': files})
+        response = jsonify({'files': files})
+        response.vary.add('Accept')
+        return response
     
     except Exception as e:
         logging.error(f"List files error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/media/<path:name>', methods=['GET'])
+def serve_media(name):
+    """Serve an upload by logical name (<upload_id>/<filename>), with Range support"""
+    try:
+        file_path = resolve_media(name)
+        if file_path is None:
+            return jsonify({'error': 'File not found'}), 404
+        return send_file(file_path, conditional=True)
+    
+    except Exception as e:
+        logging.error(f"Serve media error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/media/<path:name>/playlist.m3u8', methods=['GET'])
+def hls_playlist(name):
+    """HLS playlist of byte-range segments over a TS upload"""
+    try:
+        if not ts_index.is_ts_file(name):
+            return jsonify({'error': 'HLS playlists are only available for MPEG-TS files'}), 400
+        
+        file_path = resolve_media(name)
+        if file_path is None:
+            return jsonify({'error': 'File not found'}), 404
+        
+        cache_path = hls_cache_path(name)
+        scan = ts_index.load_scan(cache_path, file_path)
+        if scan is None:
+            error = ts_scanner.failure(file_path)
+            if error:
+                return jsonify({'error': f'Cannot build playlist: {error}'}), 422
+            ts_scanner.submit(file_path, cache_path)
+            response = jsonify({'status': 'scanning', 'message': 'File is being scanned, retry shortly'})
+            response.headers['Retry-After'] = '5'
+            return response, 202
+        
+        playlist = ts_index.build_playlist(scan, f"/media/{quote(name)}")
+        return Response(playlist, mimetype='application/vnd.apple.mpegurl')
+    
+    except Exception as e:
+        logging.error(f"Playlist error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/timings', methods=['GET'])
+def get_timings():
+    """Upload phase timings and recent slow uploads"""
+    return jsonify(timings.snapshot())
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -186,6 +320,8 @@ if __name__ == '__main__':
     
     logging.info(f"Starting SoulStream Upload Server")
     logging.info(f"Upload folder: {UPLOAD_FOLDER}")
+    logging.info(f"Storage layout: {layout.name}")
+    logging.info(f"Durability mode: {durability.mode}")
     logging.info(f"Allowed extensions: {ALLOWED_EXTENSIONS}")
     
     # Run the server
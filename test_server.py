@@ -112,6 +112,32 @@ def test_upload():
         print_status(f"Upload test error: {str(e)}", "ERROR")
         return False
 
+def test_archive():
+    """Test streaming archive download and resume"""
+    try:
+        url = f"{SERVER_URL}/archive?prefix=test_movie&format=zip"
+        response = requests.get(url, timeout=30)
+        if response.status_code == 404:
+            print_status("No test files to archive, skipping archive test", "WARNING")
+            return True
+        if response.status_code != 200:
+            print_status(f"Archive test failed with status {response.status_code}", "ERROR")
+            return False
+        
+        full = response.content
+        headers = {'Range': f'bytes={len(full) // 2}-', 'If-Range': response.headers.get('ETag', '')}
+        resumed = requests.get(url, headers=headers, timeout=30)
+        if resumed.status_code == 206 and resumed.content == full[len(full) // 2:]:
+            print_status("Archive test passed", "SUCCESS")
+            print(f"  Archive size: {len(full)} bytes")
+            return True
+        else:
+            print_status(f"Archive resume failed with status {resumed.status_code}", "ERROR")
+            return False
+    except Exception as e:
+        print_status(f"Archive test error: {str(e)}", "ERROR")
+        return False
+
 def cleanup_test_file():
     """Clean up the test file"""
     try:
@@ -145,6 +171,7 @@ def main():
         ("Files Endpoint", test_files_endpoint),
         ("Main Page", test_main_page),
         ("Upload Test", test_upload),
+        ("Archive Test", test_archive),
     ]
     
     passed = 0
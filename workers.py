@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Background file workers for SoulStream
+A single daemon thread per worker processes queued files one at a time.
+Each failure is remembered against the file's size and mtime, so a broken
+file is not retried until it changes, and one bad file never stops the
+thread. Used by the media server's seek indexer and the upload server's
+MPEG-TS scanner.
+"""
+
+import os
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def file_version(path):
+    """(size, mtime_ns) of a file, or None if it is gone"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class FileWorker:
+    """Base class: subclasses set name and description and implement process()"""
+
+    name = 'file-worker'
+    description = 'Processing'
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, media_path, *args):
+        """Queue a file unless it is pending or already failed for this file version"""
+        with self._lock:
+            if media_path in self._pending or self._failure(media_path):
+                return
+            self._pending.add(media_path)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        self._queue.put((media_path, args))
+
+    def is_pending(self, media_path):
+        with self._lock:
+            return media_path in self._pending
+
+    def failure(self, media_path):
+        """Return the error from the last failed attempt on this version of the file"""
+        with self._lock:
+            return self._failure(media_path)
+
+    def _failure(self, media_path):
+        failed = self._failed.get(media_path)
+        if failed is None:
+            return None
+        version, error = failed
+        return error if version == file_version(media_path) else None
+
+    def process(self, media_path, *args):
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            media_path, args = self._queue.get()
+            try:
+                self.process(media_path, *args)
+            except Exception as e:
+                # Record the failure and keep the worker alive for other files
+                logger.warning(f"{self.description} failed for {os.path.basename(media_path)}: {e}")
+                version = file_version(media_path)
+                if version is not None:
+                    with self._lock:
+                        self._failed[media_path] = (version, str(e))
+            finally:
+                with self._lock:
+                    self._pending.discard(media_path)